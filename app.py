@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
+import os
+import time
+import hashlib
+import contextlib
+import cProfile
+import pstats
+import marshal
 import io
-import re
-from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-from openpyxl.utils import get_column_letter
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from engine import (convert_df_to_excel_stream, write_report_bundle, build_lesson_facts, anchor_dates, span_dates, group_date_rows, date_rows_in_range, decode_dates, read_workbook, display_frame, display_window, expand_frame, expanded_nbytes,
+                    valid_class_sheets, collect_report_records, LazyWorkbook, LessonIndex, LessonStore, disk_cache_load, disk_cache_store,
+                    StageRecorder, log_event, elapsed_ms, LESSON_COLS, PARSER_VERSION)
 
 # ================= 1. 网页基础设置 & 究极 UI 美化 =================
 st.set_page_config(page_title="教师课时管理系统", page_icon="🎓", layout="wide")
@@ -118,135 +128,468 @@ st.markdown('<div class="custom-header">🎓 教师排课智能读取与精准
 if 'all_sheets' not in st.session_state: st.session_state['all_sheets'] = None
 if 'current_sheet' not in st.session_state: st.session_state['current_sheet'] = None
 if 'global_mode' not in st.session_state: st.session_state['global_mode'] = False
+if 'lesson_facts' not in st.session_state: st.session_state['lesson_facts'] = {}
+if 'lesson_index' not in st.session_state: st.session_state['lesson_index'] = {}
+if 'lesson_index_lock' not in st.session_state: st.session_state['lesson_index_lock'] = threading.Lock()
+if 'date_cells' not in st.session_state: st.session_state['date_cells'] = {}
+if 'preview_pages' not in st.session_state: st.session_state['preview_pages'] = OrderedDict()
 
-# ================= 汇报级 Excel 渲染引擎 =================
-def convert_df_to_excel_pro(df, sheet_name, title):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        export_df = df.reset_index()
-        export_df.to_excel(writer, sheet_name=sheet_name, startrow=2, index=False)
-        worksheet = writer.sheets[sheet_name]
-        
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        header_fill = PatternFill(start_color="1E3C72", end_color="1E3C72", fill_type="solid") # 换成更高级的深蓝表头
-        header_font = Font(color="FFFFFF", bold=True, size=11)
-        center_align = Alignment(horizontal='center', vertical='center')
-        
-        max_col = len(export_df.columns)
-        max_row = len(export_df) + 3 
-        
-        cell = worksheet.cell(row=1, column=1, value=title)
-        cell.font = Font(size=18, bold=True, color="000000")
-        worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=max_col)
-        cell.alignment = center_align
-        worksheet.row_dimensions[1].height = 40 
-        
-        worksheet.row_dimensions[3].height = 25
-        for col_idx in range(1, max_col + 1):
-            c = worksheet.cell(row=3, column=col_idx)
-            c.fill = header_fill
-            c.font = header_font
-            c.alignment = center_align
-            c.border = thin_border
-            
-        for r_idx in range(4, max_row + 1):
-            worksheet.row_dimensions[r_idx].height = 20 
-            for c_idx in range(1, max_col + 1):
-                c = worksheet.cell(row=r_idx, column=c_idx)
-                c.alignment = center_align
-                c.border = thin_border
-                if c_idx == 1: c.font = Font(bold=True)
-                    
-        for i in range(1, max_col + 1):
-            worksheet.column_dimensions[get_column_letter(i)].width = 15 
-
-    return output.getvalue()
-
-# ================= 智能识别与清洗引擎 =================
-def clean_excel_data(df):
-    is_schedule = False
-    for i in range(min(5, len(df))):
-        row_str = " ".join(str(x) for x in df.iloc[i].values)
-        if "星期" in row_str or re.search(r'\d{4}[-/]\d{2}[-/]\d{2}', row_str):
-            is_schedule = True; break
-            
-    if is_schedule:
-        new_cols = []
-        for idx, col in enumerate(df.columns):
-            c = str(col).strip()
-            if pd.isna(col) or c.lower() in ['nan', '', 'unnamed'] or 'unnamed' in c.lower(): c = f"未命名_{idx+1}"
-            base = c
-            counter = 1
-            while c in new_cols: c = f"{base}_{counter}"; counter += 1
-            new_cols.append(c)
-        df.columns = new_cols
-        return df.dropna(how='all', axis=1).dropna(how='all', axis=0)
+# ================= 课时事实表 =================
+# 同一张表只做一次日期锚定：日期单元格表留给日期选择器做默认值、给预览做日期行跳转，锚定出的单元格直接拿去建事实表
+def anchor_sheet(sheet_name):
+    df, facts = st.session_state['all_sheets'][sheet_name], st.session_state['lesson_facts']
+    anchors = anchor_dates(df)
+    st.session_state['date_cells'][sheet_name] = anchors[3]
+    if sheet_name not in facts: facts[sheet_name] = build_lesson_facts(sheet_name, df, anchors=anchors)
+    return anchors
+
+def get_lesson_facts(sheet_name):
+    if sheet_name not in st.session_state['lesson_facts']: anchor_sheet(sheet_name)
+    return st.session_state['lesson_facts'][sheet_name]
+
+# 整本读入的工作簿在上传时已随事实表带回各表的日期单元格表 (子进程或列存缓存里来的)；
+# 只有按需加载模式下单独点开、还没扫描过的表才在这里锚定，事实表顺带一起建好
+def get_date_cells(sheet_name):
+    if sheet_name not in st.session_state['date_cells']: anchor_sheet(sheet_name)
+    return st.session_state['date_cells'][sheet_name]
+
+# 补齐尚未扫描的表：按需加载的工作簿交给进程池并行读取 + 扫描，已在内存里的表直接就地扫描
+# 按完成顺序产出 (表名, 事实表)，同时把事实表和日期单元格表写回会话缓存，中途取消也不会丢掉已完成的部分
+def scan_missing_sheets(names, recorder=None):
+    book, facts = st.session_state['all_sheets'], st.session_state['lesson_facts']
+    def build_in_place(name):
+        t0, df = time.perf_counter(), book[name]
+        anchors = anchor_dates(df)
+        anchor_ms = elapsed_ms(t0)
+        stats = {'rows': len(df), 'cols': len(df.columns)}
+        sheet_facts = build_lesson_facts(name, df, stats, anchors=anchors)
+        stats.update(anchor_ms=anchor_ms, total_ms=elapsed_ms(t0))
+        if recorder: recorder.add_sheet(name, stats)
+        return name, sheet_facts, anchors[3]
+    results = book.iter_load(names, recorder=recorder) if isinstance(book, LazyWorkbook) else (build_in_place(name) for name in names)
+    with contextlib.closing(results):
+        for name, sheet_facts, date_cells in results:
+            facts[name] = sheet_facts
+            st.session_state['date_cells'][name] = date_cells
+            yield name, sheet_facts
+
+# ================= 前缀和查询索引 =================
+# 同一列窗口只建一次索引；窗口改动才重建，最多保留最近几个窗口
+# 索引只覆盖用到过的表 (按需加载模式下不必为了建索引把整本工作簿读进来)，请求超出覆盖范围时按并集重建
+# 在后台报表任务里调用，不碰 st.session_state：会话里的事实表快照、索引缓存和锁由提交任务的一方传进来
+def get_lesson_index(lesson_facts, index_cache, index_lock, col_lo, col_hi, sheets):
+    with index_lock:
+        key = (col_lo, col_hi)
+        lesson_index = index_cache.get(key)
+        if lesson_index is None or not set(sheets) <= lesson_index.covered:
+            covered = set(sheets) | (lesson_index.covered if lesson_index is not None else set())
+            facts = pd.concat([lesson_facts[name] for name in lesson_facts if name in covered], ignore_index=True)
+            lesson_index = LessonIndex(facts, col_lo, col_hi)
+            lesson_index.covered = covered
+            index_cache[key] = lesson_index
+            while len(index_cache) > 8: index_cache.pop(next(iter(index_cache)))
+        return lesson_index
+
+# ================= 跨会话共享的解析缓存 =================
+# 以上传文件内容的 SHA-256 为键；同一份总表无论被谁、第几次上传，都只解析一次
+INGEST_CACHE_MAX_ENTRIES = int(os.environ.get('KESHI_INGEST_CACHE_ENTRIES', 8))
+INGEST_CACHE_MAX_MB = float(os.environ.get('KESHI_INGEST_CACHE_MB', 1024))
+INGEST_CACHE_TTL = float(os.environ.get('KESHI_INGEST_CACHE_TTL', 6 * 3600))
+
+class IngestCache:
+    def __init__(self, max_entries, max_mb, ttl):
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_mb * 1024 * 1024, ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry['at'] > self.ttl:
+                del self.entries[key]; entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            self.entries[key] = {'value': value, 'bytes': nbytes, 'at': time.time()}
+            self.entries.move_to_end(key)
+            # 最近最少使用的先淘汰；刚放入的这份即使单独超限也保留，避免白解析
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.total_bytes() > self.max_bytes):
+                self.entries.popitem(last=False)
+
+    def total_bytes(self):
+        return sum(e['bytes'] for e in self.entries.values())
+
+@st.cache_resource
+def get_ingest_cache():
+    return IngestCache(INGEST_CACHE_MAX_ENTRIES, INGEST_CACHE_MAX_MB, INGEST_CACHE_TTL)
+
+# 学期课时库所有会话共用一个实例 (内部每次操作单独开连接)；跨周汇总时界面上最多预览这么多条明细
+SEMESTER_PREVIEW_ROWS = int(os.environ.get('KESHI_SEMESTER_PREVIEW_ROWS', 5000))
+
+@st.cache_resource
+def get_lesson_store():
+    return LessonStore()
+
+# 把一份工作簿的事实表存入学期课时库，结果写进 session 供侧边栏提示；库出错不影响本次上传的使用
+# 默认只追加库里还没有的班级周，replace=True 作为更正，只替换该文件实际包含的周
+def store_lesson_facts(file_hash, file_name, lesson_facts, replace=False):
+    try: st.session_state['store_result'] = get_lesson_store().ingest(file_hash, file_name, lesson_facts, replace=replace)
+    except Exception as e: st.session_state['store_result'] = {'status': 'error', 'error': str(e)}
+
+def frames_nbytes(frames):
+    return int(sum(df.memory_usage(deep=True).sum() for df in frames.values()))
+
+# 读取 + 清洗 + 构建事实表；返回 (清洗后的表, 事实表, 日期单元格表, 数据来源 'memory' / 'disk' / 'excel' / 'lazy')
+# recorder 记下各步耗时，真正解析 Excel 时还有逐表开销
+# 缓存里的 DataFrame 被所有会话共用，调用方只读不改
+# lazy=True 时若共享缓存里没有现成结果，只读表目录，表格与事实表都留到用到时再建
+def ingest_workbook(file_bytes, progress=None, lazy=False, key=None, recorder=None):
+    recorder = recorder or StageRecorder('ingest')
+    key = key or hashlib.sha256(file_bytes).hexdigest()
+    cache = get_ingest_cache()
+    cached = cache.get(key)
+    if cached is not None: return (*cached, 'memory')
+    if lazy:
+        with recorder.stage('read_sheet_names'): return LazyWorkbook(file_bytes), {}, {}, 'lazy'
+
+    source = 'disk'
+    with recorder.stage('disk_cache_load'): loaded = disk_cache_load(key)
+    if loaded is not None:
+        clean_sheets, lesson_facts, date_cells = loaded
     else:
-        header_idx = -1
-        for i in range(min(10, len(df))):
-            if any(k in str(df.iloc[i].values) for k in ["姓名", "科目", "类别", "课数"]):
-                header_idx = i; break
-        if header_idx != -1:
-            raw_cols = df.iloc[header_idx].tolist()
-            df = df.iloc[header_idx + 1:].reset_index(drop=True)
-        else:
-            raw_cols = df.columns.tolist() 
-            new_cols = []
-            for idx, col in enumerate(raw_cols):
-                c = str(col).strip()
-                if pd.isna(col) or c.lower() in ['nan', '', 'unnamed'] or 'unnamed' in c.lower(): c = f"未命名_{idx+1}"
-                base = c
-                counter = 1
-                while c in new_cols: c = f"{base}_{counter}"; counter += 1
-                new_cols.append(c)
-            df.columns = new_cols
-        return df.dropna(how='all', axis=1).dropna(how='all', axis=0)
-
-# ================= 核心统计算法库 =================
-def parse_class_string(val_str):
-    val_str = str(val_str).replace(" ", "") 
-    ignore = ['0', '0.0', 'nan', 'none', '星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日', '体育', '班会', '国学', '美术', '音乐', '大扫除']
-    if not val_str or val_str.lower() in ignore or re.search(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}', val_str) or re.search(r'^第[一二三四五六七八九十]+周', val_str):
-        return None
-        
-    count = 1.0
-    m_num = re.search(r'(\d+(?:\.\d+)?)$', val_str)
-    if m_num:
-        if m_num.start() == 0: return None
-        count = float(m_num.group(1))
-        val_str = val_str[:m_num.start()] 
-        
-    match = re.match(r'^([\u4e00-\u9fa5a-zA-Z]+?)(高[一二三]|初[一二三]|小[一二三四五六])(.*)$', val_str)
-    if match: return {'教师姓名': match.group(1), '课程类别': match.group(2) + match.group(3), '课时数': count}
-        
-    known_types = ['早自', '正大', '正小', '晚自', '自大', '自小', '辅导', '正课', '早读', '晚修']
-    for kt in known_types:
-        if val_str.endswith(kt): return {'教师姓名': val_str[:-len(kt)], '课程类别': kt, '课时数': count}
-            
-    if len(val_str) >= 2: return {'教师姓名': val_str, '课程类别': '常规课', '课时数': count}
+        source = 'excel'
+        with recorder.stage('read_workbook'): clean_sheets, lesson_facts, date_cells = read_workbook(file_bytes, progress=progress, recorder=recorder)
+        with recorder.stage('disk_cache_store'): disk_cache_store(key, clean_sheets, lesson_facts, date_cells)
+    cache.put(key, (clean_sheets, lesson_facts, date_cells), frames_nbytes(clean_sheets) + frames_nbytes(lesson_facts) + frames_nbytes(date_cells))
+    return clean_sheets, lesson_facts, date_cells, source
+
+# ================= 后台报表任务 =================
+# 点生成后的取明细、透视、导出汇总表在后台线程里跑，页面上别的控件一动触发重跑也不会打断或白算一遍；
+# 结果按 (工作簿指纹, 班级, 列窗口, 日期段, 解析器版本, 标题) 缓存，所有会话共用，最近最少使用的先淘汰
+REPORT_WORKERS = int(os.environ.get('KESHI_REPORT_WORKERS', 2))
+REPORT_CACHE_MAX_ENTRIES = int(os.environ.get('KESHI_REPORT_CACHE_ENTRIES', 32))
+REPORT_CACHE_MAX_MB = float(os.environ.get('KESHI_REPORT_CACHE_MB', 256))
+# 提交后先在本次运行里等这么久，很快就能算完的报表直接出结果；还没完成的显示进度，每隔 REPORT_POLL_SECONDS 查一次
+REPORT_WAIT_SECONDS = float(os.environ.get('KESHI_REPORT_WAIT', 1.0))
+REPORT_POLL_SECONDS = 1.0
+
+class ReportJobs:
+    def __init__(self, workers, max_entries, max_mb):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='keshi-report')
+        self.max_entries, self.max_bytes = max_entries, max_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            job = self.entries.get(key)
+            if job is not None: self.entries.move_to_end(key)
+            return job
+
+    # 同一查询已在跑或已有结果时直接返回原任务；失败过的任务、以及 refresh=True 时重新计算
+    # inline=True 时就在调用线程里算完再返回 (采集 cProfile 只能看到本线程)
+    # refresh 时即使同一查询正在后台跑也另起一份顶替缓存条目，原任务照常跑完、结果丢弃，否则 cProfile 什么也采不到
+    def submit(self, key, fn, *args, refresh=False, inline=False):
+        with self.lock:
+            job = self.entries.get(key)
+            if job is not None and job['status'] != 'error' and not refresh:
+                self.entries.move_to_end(key)
+                return job
+            job = {'status': 'running', 'result': None, 'error': None, 'stages': None, 'bytes': 0, 'submitted': time.time(), 'future': None}
+            self.entries[key] = job
+            self.entries.move_to_end(key)
+            if not inline: job['future'] = self.pool.submit(self._run, job, fn, args)
+        if inline: self._run(job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        recorder = StageRecorder('report_job')
+        try: result = fn(*args, recorder=recorder)
+        except Exception as e:
+            log_event('report_job_error', error=str(e))
+            with self.lock: job.update(status='error', error=str(e))
+            return
+        nbytes = frames_nbytes({k: v for k, v in result.items() if isinstance(v, pd.DataFrame)}) + len(result.get('excel_data') or b'')
+        with self.lock:
+            job.update(status='done', result=result, stages=recorder.stages, bytes=nbytes)
+            self.evict()
+
+    # 正在跑的任务不淘汰；刚完成的这份即使单独超限也保留
+    def evict(self):
+        for key in list(self.entries)[:-1]:
+            if len(self.entries) <= self.max_entries and self.total_bytes() <= self.max_bytes: break
+            if self.entries[key]['status'] != 'running': del self.entries[key]
+
+    def total_bytes(self):
+        return sum(job['bytes'] for job in self.entries.values())
+
+    def running(self):
+        return sum(job['status'] == 'running' for job in self.entries.values())
+
+@st.cache_resource
+def get_report_jobs():
+    return ReportJobs(REPORT_WORKERS, REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_MAX_MB)
+
+# 本次上传的工作簿指纹；没有走上传流程的会话 (直接塞进 session 的表) 退回到对象 id，只在本会话内有效
+def workbook_key():
+    upload = st.session_state.get('upload_file')
+    return upload[0] if upload else f"session-{id(st.session_state['all_sheets'])}"
+
+# 以下两个函数在后台线程里运行，只用传进来的参数，不碰 st.* 
+def compute_upload_report(lesson_facts, index_cache, index_lock, targets, col_lo, col_hi, f_start, f_end, sheet_name, title, recorder):
+    with recorder.stage('select_records'): stat_df = collect_report_records(lesson_facts, targets, col_lo, col_hi, f_start, f_end)
+    if stat_df.empty: return {'stat_df': stat_df}
+    with recorder.stage('pivot'):
+        lesson_index = get_lesson_index(lesson_facts, index_cache, index_lock, col_lo, col_hi, targets)
+        pivot_df = lesson_index.pivot(f_start, f_end, sheets=targets)
+        pivot_df['总计'] = pivot_df.sum(axis=1)
+        query_note = f"⚡ 前缀和索引查询耗时 {lesson_index.last_query_ms:.2f} ms"
+    with recorder.stage('export_pivot'): excel_data = convert_df_to_excel_stream(pivot_df, sheet_name=sheet_name, title=title)
+    return {'stat_df': stat_df, 'pivot_df': pivot_df, 'query_note': query_note, 'excel_data': excel_data}
+
+# 跨周模式下明细只取前若干行做预览，汇总在库里聚合；完整明细到导出报表包时再查
+def compute_semester_report(lesson_store, targets, col_lo, col_hi, f_start, f_end, sheet_name, title, recorder):
+    with recorder.stage('select_records'): stat_df = lesson_store.query_records(targets, f_start, f_end, col_lo, col_hi, limit=SEMESTER_PREVIEW_ROWS)
+    if stat_df.empty: return {'stat_df': stat_df}
+    with recorder.stage('pivot'):
+        t0 = time.perf_counter()
+        pivot_df = lesson_store.query_pivot(targets, f_start, f_end, col_lo, col_hi)
+        query_note = f"📚 学期课时库聚合查询耗时 {(time.perf_counter() - t0) * 1000:.1f} ms"
+    with recorder.stage('export_pivot'): excel_data = convert_df_to_excel_stream(pivot_df, sheet_name=sheet_name, title=title)
+    return {'stat_df': stat_df, 'pivot_df': pivot_df, 'query_note': query_note, 'excel_data': excel_data}
+
+def upload_report_key(targets, col_lo, col_hi, f_start, f_end, sheet_name, title):
+    return ('upload', workbook_key(), tuple(targets), col_lo, col_hi, f_start, f_end, PARSER_VERSION, sheet_name, title)
+
+# 提交 (或取回) 一份上传工作簿上的报表任务；事实表只传外层字典的浅拷贝，任务里看到的是提交这一刻的快照
+def submit_upload_report(targets, col_lo, col_hi, f_start, f_end, sheet_name, title, **kw):
+    key = upload_report_key(targets, col_lo, col_hi, f_start, f_end, sheet_name, title)
+    return get_report_jobs().submit(key, compute_upload_report, dict(st.session_state['lesson_facts']), st.session_state['lesson_index'],
+                                    st.session_state['lesson_index_lock'], list(targets), col_lo, col_hi, f_start, f_end, sheet_name, title, **kw)
+
+# 还没完成的任务显示进度；片段定时自查，任务结束后整页重跑把结果画出来
+@st.fragment(run_every=REPORT_POLL_SECONDS)
+def report_status(job, label):
+    if job['status'] != 'running': st.rerun()
+    st.info(f"⏳ 正在后台生成{label}，已用时 {time.time() - job['submitted']:.0f} 秒；可以继续操作页面，完成后自动显示。")
+
+# 稍等一会儿任务结果：完成时返回结果字典，仍在运行或失败时显示状态并返回 None
+def await_report(job, label):
+    if job['future'] is not None: wait([job['future']], timeout=REPORT_WAIT_SECONDS)
+    if job['status'] == 'error': st.error(f"❌ {label}生成失败：{job['error']}")
+    elif job['status'] == 'running': report_status(job, label)
+    else: return job['result']
     return None
 
+# ================= 性能诊断 =================
+STAGE_LABELS = {'hash': '计算文件指纹', 'disk_cache_load': '读取列存缓存', 'read_workbook': '解析 Excel (全部表)', 'disk_cache_store': '写入列存缓存',
+                'read_sheet_names': '读取表目录', 'lesson_store': '存入学期课时库', 'scan_missing': '扫描未解析的班级', 'select_records': '筛选课时明细',
+                'pivot': '汇总透视', 'export_pivot': '导出汇总表', 'export_bundle': '导出报表包', 'wait_report': '等待后台报表'}
+SHEET_COLUMNS = {'rows': '行数', 'cols': '列数', 'cells': '扫描单元格', 'records': '课时记录', 'read_ms': '读取 ms', 'clean_ms': '清洗 ms',
+                 'anchor_ms': '日期锚定 ms', 'parse_ms': '解析 ms', 'total_ms': '合计 ms'}
+
+# 只对这一次报表生成采集 cProfile (子进程里的解析不在其中)；脚本被取消或重跑打断时同样停表，结果放进 session 供下载
+@contextlib.contextmanager
+def profile_report(enabled):
+    profiler = cProfile.Profile() if enabled else None
+    if profiler is not None:
+        try: profiler.enable()
+        except ValueError: profiler = None  # 已有别的性能分析工具在运行
+    try: yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.create_stats()
+            summary = io.StringIO()
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+            st.session_state['profile_result'] = {'prof': marshal.dumps(profiler.stats), 'text': summary.getvalue(), 'at': time.strftime('%Y%m%d_%H%M%S')}
+            log_event('profile', functions=len(profiler.stats))
+
+def stage_table(recorder):
+    return pd.DataFrame({'阶段': [STAGE_LABELS.get(k, k) for k in recorder.stages], '耗时 ms': list(recorder.stages.values())})
+
+def render_diagnostics():
+    with st.expander("🩺 性能诊断", expanded=True):
+        book = st.session_state['all_sheets']
+        loaded = book.loaded if isinstance(book, LazyWorkbook) else book
+        facts = st.session_state['lesson_facts']
+        # 括号里是同样数据按改造前的普通列 (日期对象、64 位数值) 存放时的估算，用来核对紧凑存储省下了多少
+        sheets_mb, facts_mb = frames_nbytes(dict(loaded)) / 1024 / 1024, frames_nbytes(facts) / 1024 / 1024
+        sheets_obj_mb = sum(expanded_nbytes(df) for df in loaded.values()) / 1024 / 1024
+        facts_obj_mb = sum(expanded_nbytes(df) for df in facts.values()) / 1024 / 1024
+        log_event('memory', sheets=len(loaded), all_sheets_mb=round(sheets_mb, 2), all_sheets_object_mb=round(sheets_obj_mb, 2),
+                  lesson_facts_mb=round(facts_mb, 2), lesson_facts_object_mb=round(facts_obj_mb, 2))
+        st.caption(f"🧠 all_sheets：{len(loaded)} 张表常驻 · {sheets_mb:.1f} MB (普通存储约 {sheets_obj_mb:.1f} MB)　|　"
+                   f"事实表：{len(facts)} 张 · {facts_mb:.1f} MB (普通存储约 {facts_obj_mb:.1f} MB)　|　"
+                   f"本会话合计 {sheets_mb + facts_mb:.1f} MB，改造前约 {sheets_obj_mb + facts_obj_mb:.1f} MB")
+
+        ingest_recorder, report_recorder = st.session_state.get('diag_ingest'), st.session_state.get('diag_report')
+        col_a, col_b = st.columns(2)
+        with col_a:
+            st.markdown("**📥 上传解析**")
+            if ingest_recorder is not None and ingest_recorder.stages: st.dataframe(stage_table(ingest_recorder), hide_index=True, use_container_width=True)
+            else: st.caption("暂无记录")
+        with col_b:
+            st.markdown("**🌐 最近一次全局报表**")
+            if report_recorder is not None and report_recorder.stages: st.dataframe(stage_table(report_recorder), hide_index=True, use_container_width=True)
+            else: st.caption("暂无记录")
+
+        sheet_stats = st.session_state.get('diag_sheets')
+        if sheet_stats:
+            st.markdown("**📄 逐表开销**")
+            per_sheet = pd.DataFrame.from_dict(sheet_stats, orient='index').reindex(columns=list(SHEET_COLUMNS)).rename(columns=SHEET_COLUMNS)
+            st.dataframe(per_sheet.sort_values('合计 ms', ascending=False), use_container_width=True)
+        else:
+            st.caption("暂无逐表解析记录 (数据来自缓存，或还没有扫描过任何表)")
+
+        profile = st.session_state.get('profile_result')
+        if profile is not None:
+            st.markdown("**🧪 cProfile 采样结果** (按累计耗时排序的前 40 项)")
+            st.download_button("⬇️ 下载 .prof 文件 (可用 snakeviz 等工具打开)", data=profile['prof'], file_name=f"keshi_report_{profile['at']}.prof", mime="application/octet-stream")
+            st.code(profile['text'], language=None)
+
+# ================= 分页预览 =================
+# 只格式化、只下发可见的行列窗口；格式化好的页按 (表, 行页, 列页) 缓存在会话里，翻回看过的页不再重算
+PREVIEW_PAGE_ROWS = int(os.environ.get('KESHI_PREVIEW_ROWS', 100))
+PREVIEW_PAGE_COLS = int(os.environ.get('KESHI_PREVIEW_COLS', 30))
+PREVIEW_CACHE_PAGES = 64
+
+def preview_page(sheet_name, row_page, col_page):
+    pages, key = st.session_state['preview_pages'], (sheet_name, row_page, col_page)
+    if key in pages:
+        pages.move_to_end(key)
+        return pages[key]
+    r0, c0 = row_page * PREVIEW_PAGE_ROWS, col_page * PREVIEW_PAGE_COLS
+    pages[key] = display_window(st.session_state['all_sheets'][sheet_name], slice(r0, r0 + PREVIEW_PAGE_ROWS), slice(c0, c0 + PREVIEW_PAGE_COLS))
+    while len(pages) > PREVIEW_CACHE_PAGES: pages.popitem(last=False)
+    return pages[key]
+
+# 选中日期行后同时翻到它所在的行页和列页 (该行最靠左的日期单元格所在列；在控件渲染前的回调里改页码)
+def jump_to_date_row(sheet_name):
+    target = st.session_state[f"preview_jump_{sheet_name}"]
+    if target is None: return
+    row, col = target
+    st.session_state[f"preview_row_page_{sheet_name}"] = row // PREVIEW_PAGE_ROWS + 1
+    st.session_state[f"preview_col_page_{sheet_name}"] = col // PREVIEW_PAGE_COLS + 1
+
+def date_row_label(df, rows, target):
+    row, col = target
+    first, last = decode_dates([rows.at[row, 'min'], rows.at[row, 'max']])
+    return f"第 {df.index[row]} 行 · 第 {col + 1} 列 · {first}" + ('' if first == last else f" 至 {last}")
+
+def render_preview(sheet_name):
+    df = st.session_state['all_sheets'][sheet_name]
+    n_row_pages, n_col_pages = max(1, -(-len(df) // PREVIEW_PAGE_ROWS)), max(1, -(-len(df.columns) // PREVIEW_PAGE_COLS))
+    # 页码按表记在会话里；换了一份更小的工作簿时先把越界的页码收回来
+    for key, n_pages in ((f"preview_row_page_{sheet_name}", n_row_pages), (f"preview_col_page_{sheet_name}", n_col_pages)):
+        if st.session_state.get(key, 1) > n_pages: st.session_state[key] = n_pages
+
+    # 日期行来自日期单元格表：本班统计页选了列窗口和日期段时只列其中的行，否则列出整张表的日期行
+    date_cells, window = get_date_cells(sheet_name), st.session_state.get('class_dates')
+    if window and window[0] == sheet_name: rows = date_rows_in_range(date_cells, *window[1:])
+    else: rows = group_date_rows(date_cells)
+
+    col_a, col_b, col_c, col_d = st.columns([1, 1, 2, 1])
+    with col_a: row_page = st.number_input(f"行页 (共 {n_row_pages} 页)", min_value=1, max_value=n_row_pages, key=f"preview_row_page_{sheet_name}") - 1
+    with col_b: col_page = st.number_input(f"列页 (共 {n_col_pages} 页)", min_value=1, max_value=n_col_pages, key=f"preview_col_page_{sheet_name}") - 1
+    with col_c: st.selectbox("📅 跳到日期行", options=list(zip(rows.index.tolist(), rows['列序号'].tolist())), index=None,
+                             format_func=lambda target: date_row_label(df, rows, target),
+                             placeholder=f"所选日期段共 {len(rows)} 个日期行" if len(rows) else "没有匹配的日期行", disabled=rows.empty,
+                             key=f"preview_jump_{sheet_name}", on_change=jump_to_date_row, args=(sheet_name,))
+    with col_d: full = st.checkbox("📜 整表预览", help="一次性格式化并渲染整张表，大表会明显变慢")
+
+    if full:
+        st.dataframe(display_frame(df), use_container_width=True, height=350)
+        return
+    st.dataframe(preview_page(sheet_name, row_page, col_page), use_container_width=True, height=350)
+    r0, c0 = row_page * PREVIEW_PAGE_ROWS, col_page * PREVIEW_PAGE_COLS
+    st.caption(f"第 {r0 + 1}-{min(r0 + PREVIEW_PAGE_ROWS, len(df))} 行、第 {c0 + 1}-{min(c0 + PREVIEW_PAGE_COLS, len(df.columns))} 列 (全表 {len(df)} 行 × {len(df.columns)} 列)")
+
 # ================= 侧边栏与全局汇总配置 =================
 st.sidebar.markdown('<div style="text-align:center; padding-bottom:10px;"><h2 style="color:#1e3c72; font-weight:bold;">📁 数据控制台</h2></div>', unsafe_allow_html=True)
 uploaded_file = st.sidebar.file_uploader("请拖拽或点击上传 Excel (.xlsm/xlsx)", type=["xlsm", "xlsx"])
+lazy_mode = st.sidebar.checkbox("🪶 按需加载 (适合多年度超大工作簿)", help="上传时只读取表目录，点击导航或纳入全局统计的表才会被解析")
 
-if uploaded_file is not None and st.session_state['all_sheets'] is None:
+if uploaded_file is not None and (uploaded_file.file_id, lazy_mode) != st.session_state.get('upload_id'):
     try:
         with st.spinner('正在执行双引擎解析，请稍候...'):
-            raw_sheets = pd.read_excel(uploaded_file, sheet_name=None, engine='openpyxl')
-            clean_sheets = {}
-            for sheet_name, df in raw_sheets.items(): clean_sheets[sheet_name] = clean_excel_data(df)
-            st.session_state['all_sheets'] = clean_sheets
+            sheet_bar = st.sidebar.progress(0.0)
+            def show_sheet_progress(done, total, name): sheet_bar.progress(done / total, text=f"已解析 {done}/{total} 张表：{name}")
+            ingest_recorder = StageRecorder('ingest')
+            file_bytes = uploaded_file.getvalue()
+            with ingest_recorder.stage('hash'): file_hash = hashlib.sha256(file_bytes).hexdigest()
+            clean_sheets, lesson_facts, date_cells, source = ingest_workbook(file_bytes, progress=show_sheet_progress, lazy=lazy_mode, key=file_hash, recorder=ingest_recorder)
+            sheet_bar.empty()
+            st.session_state['store_result'] = None
+            log_event('ingest', file=uploaded_file.name, bytes=len(file_bytes), source=source, sheets=len(clean_sheets))
+            st.session_state['diag_ingest'] = ingest_recorder
+            st.session_state['diag_sheets'] = ingest_recorder.sheets
+            # 只复制外层字典，DataFrame 与其它会话共享同一份内存；按需加载的工作簿本身就是每会话一份
+            st.session_state['lesson_facts'] = dict(lesson_facts)
+            st.session_state['lesson_index'] = {}
+            st.session_state['date_cells'] = dict(date_cells)
+            st.session_state['preview_pages'] = OrderedDict()
+            st.session_state['all_sheets'] = clean_sheets if source == 'lazy' else dict(clean_sheets)
             st.session_state['current_sheet'] = list(clean_sheets.keys())[0]
-            st.sidebar.success("✅ 文件解析成功！")
+            st.session_state['upload_id'] = (uploaded_file.file_id, lazy_mode)
+            st.session_state['upload_file'] = (file_hash, uploaded_file.name)
+            if source == 'memory': st.sidebar.success("⚡ 命中共享缓存，文件秒开！")
+            elif source == 'disk': st.sidebar.success("💾 命中本地列存缓存，免去重新解析 Excel！")
+            elif source == 'lazy': st.sidebar.success(f"📑 已读取 {len(clean_sheets)} 张表的目录，表格将按需解析！")
+            else: st.sidebar.success("✅ 文件解析成功！")
     except Exception as e:
         st.error(f"严重错误: {e}")
 
+if st.session_state['all_sheets'] is not None:
+    ingest_cache = get_ingest_cache()
+    st.sidebar.caption(f"🗄️ 共享解析缓存：{len(ingest_cache.entries)} 份工作簿 · {ingest_cache.total_bytes() / 1024 / 1024:.1f} MB · 命中 {ingest_cache.hits} / 未命中 {ingest_cache.misses}")
+    report_jobs = get_report_jobs()
+    st.sidebar.caption(f"🧾 报表结果缓存：{len(report_jobs.entries)} 份 · {report_jobs.total_bytes() / 1024 / 1024:.1f} MB · 后台生成中 {report_jobs.running()} 份")
+    if isinstance(st.session_state['all_sheets'], LazyWorkbook):
+        lazy_book = st.session_state['all_sheets']
+        st.sidebar.caption(f"🪶 按需加载：已载入 {len(lazy_book.loaded)}/{len(lazy_book)} 张表 (最多常驻 {lazy_book.max_loaded} 张)")
+
+    # 存入学期课时库需要用户明确点击：默认只追加新的周，更正才替换文件所含的周
+    store_col1, store_col2 = st.sidebar.columns(2)
+    store_append = store_col1.button("📥 存入学期课时库", use_container_width=True, help="只追加库里还没有的班级周，已存在的周保持不变")
+    store_replace = store_col2.button("✏️ 作为更正存入", use_container_width=True, help="用本文件替换库里同一班级、同一周的记录，不影响文件未包含的周")
+    if store_append or store_replace:
+        store_recorder = st.session_state.get('diag_ingest') or StageRecorder('ingest')
+        with store_recorder.stage('lesson_store'):
+            # 按需加载模式上传时不解析全部表，存入前需要先把剩下的表扫一遍
+            if isinstance(st.session_state['all_sheets'], LazyWorkbook):
+                missing = [s for s in st.session_state['all_sheets'].keys() if s not in st.session_state['lesson_facts']]
+                if missing:
+                    store_bar = st.sidebar.progress(0.0)
+                    for done, (s_name, _) in enumerate(scan_missing_sheets(missing, recorder=store_recorder), 1):
+                        store_bar.progress(done / len(missing), text=f"已解析 {done}/{len(missing)} 张表：{s_name}")
+                    store_bar.empty()
+            store_lesson_facts(*st.session_state['upload_file'], st.session_state['lesson_facts'], replace=store_replace)
+
+    store_result = st.session_state.get('store_result')
+    if store_result is not None:
+        if store_result['status'] == 'error': st.sidebar.warning(f"⚠️ 学期课时库写入失败：{store_result['error']}")
+        elif store_result['status'] == 'skipped': st.sidebar.caption("📚 该文件此前已存入学期课时库")
+        else:
+            st.sidebar.caption(f"📚 已存入学期课时库：{store_result['rows']} 条记录 (替换旧记录 {store_result['replaced']} 条)")
+            if store_result['conflicts']: st.sidebar.warning(f"⚠️ 有 {store_result['conflicts']} 个班级周库里已有记录，已跳过；如需覆盖请点「作为更正存入」")
+    with contextlib.suppress(Exception):
+        store_info = get_lesson_store().summary()
+        if store_info['files']: st.sidebar.caption(f"📚 学期课时库：{store_info['files']} 份文件 · {store_info['date_min']} 至 {store_info['date_max']} · {store_info['rows']} 条记录")
+    show_diagnostics = st.sidebar.checkbox("🩺 显示性能诊断", help="各阶段耗时、逐表开销与内存占用；计算内存占用需要遍历所有表，数据量大时会稍慢")
+
 if st.session_state['all_sheets'] is not None:
     st.sidebar.markdown("---")
     st.sidebar.markdown('<h4 style="color:#2a5298;">🌐 全局统计生成器</h4>', unsafe_allow_html=True)
     
-    valid_classes = [s for s in st.session_state['all_sheets'].keys() if not any(kw in s for kw in ['总表', '分表', '汇总'])]
+    valid_classes = valid_class_sheets(st.session_state['all_sheets'].keys())
     scope = st.sidebar.radio("📌 统计范围选择", ["所有班级 (全校)", "按年级多选", "自定义勾选班级"])
     
     target_classes = []
@@ -264,6 +607,9 @@ if st.session_state['all_sheets'] is not None:
     with col_g2: g_end_idx = st.number_input("结束列数", min_value=1, value=21)
     
     g_dates = st.sidebar.date_input("🗓️ 限定统计时间段", [])
+    g_semester = st.sidebar.checkbox("📚 跨周汇总 (查询学期课时库)", help="统计历次上传存入学期课时库的所有周；与单份工作簿一样按上面的起止列数和日期段截取 (各周文件需沿用同一课表模板的列布局)")
+    
+    g_profile = st.sidebar.checkbox("🧪 为本次生成采集 cProfile", help="只对点击生成后的这一次运行采样，结果在性能诊断面板里下载")
     
     if st.sidebar.button("🚀 一键生成全局报表", use_container_width=True, type="primary"):
         if len(g_dates) < 1:
@@ -277,6 +623,8 @@ if st.session_state['all_sheets'] is not None:
             st.session_state['g_dates'] = g_dates
             st.session_state['g_targets'] = target_classes
             st.session_state['g_scope'] = scope
+            st.session_state['g_semester'] = g_semester
+            st.session_state['g_profile'] = g_profile
 
 # ================= 动态顶部导航 =================
 if st.session_state['all_sheets'] is not None:
@@ -318,127 +666,126 @@ if st.session_state['all_sheets'] is not None:
         st.markdown(f"<h3 style='color:#1e3c72;'>🌐 【{report_title_prefix}】课时总汇 📅 ({f_start} 至 {f_end})</h3>", unsafe_allow_html=True)
         st.info(f"系统正在扫描以下 {len(targets)} 个班级：{', '.join(targets[:5])}{' ...' if len(targets)>5 else ''}")
         
-        all_records = []
-        for s_name in targets:
-            if s_name not in st.session_state['all_sheets']: continue
-            s_df = st.session_state['all_sheets'][s_name]
-            
-            start_i = max(0, st.session_state['g_start'] - 1)
-            end_i = min(len(s_df.columns), st.session_state['g_end'])
-            if start_i >= end_i: continue
-                
-            locked_cols = s_df.columns[start_i:end_i]
-            for col in locked_cols:
-                current_date = None
-                for val in s_df[col]:
-                    val_str = str(val).strip()
-                    m = re.search(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', val_str)
-                    if m:
-                        try: current_date = pd.to_datetime(m.group(1)).date()
-                        except: pass
-                        continue
-                    
-                    if current_date and (f_start <= current_date <= f_end):
-                        parsed = parse_class_string(val_str)
-                        if parsed:
-                            parsed['来源班级'] = s_name
-                            parsed['来源日期'] = str(current_date)
-                            all_records.append(parsed)
-                            
-        if all_records:
-            stat_df = pd.DataFrame(all_records)
-            pivot_df = pd.pivot_table(stat_df, values='课时数', index='教师姓名', columns='课程类别', aggfunc='sum', fill_value=0)
-            pivot_df['总计'] = pivot_df.sum(axis=1)
-            
-            st.success(f"🎉 统计完毕！共 {len(stat_df['教师姓名'].unique())} 位老师上了课，总计 {stat_df['课时数'].sum()} 节。")
-            st.dataframe(pivot_df, use_container_width=True)
-            
+        # 每次渲染报表都记一份阶段耗时；勾选了采集 cProfile 时只对点按钮后的这一次渲染采样
+        report_recorder = StageRecorder('report', sheets=st.session_state.setdefault('diag_sheets', OrderedDict()))
+        st.session_state['diag_report'] = report_recorder
+        profiling = st.session_state.pop('g_profile', False)
+        with profile_report(profiling):
+            semester = st.session_state.get('g_semester', False)
+            missing = [] if semester else [s for s in targets if s in st.session_state['all_sheets'] and s not in st.session_state['lesson_facts']]
+            if missing:
+                # 扫描过程中点取消会触发 Streamlit 重跑、打断下面的循环 (未开始的任务随之撤销，正在子进程里读的表读完即丢弃)，重跑时这里读到的就是 True
+                if st.button("⛔ 取消本次统计", key="cancel_global_scan"):
+                    st.session_state['global_mode'] = False
+                    st.warning("已取消本次全局统计，已扫描完的班级会保留，下次直接复用；取消时正在读取的几张表会在后台读完后丢弃。")
+                    st.stop()
+                scan_bar = st.progress(0.0, text=f"🔄 正在并行扫描 {len(missing)} 个班级...")
+                with report_recorder.stage('scan_missing'):
+                    for done, (s_name, _) in enumerate(scan_missing_sheets(missing, recorder=report_recorder), 1):
+                        scan_bar.progress(done / len(missing), text=f"🔄 已扫描 {done}/{len(missing)} 个班级：{s_name}")
+                scan_bar.empty()
+
+            # 取明细、透视、导出汇总表交给后台任务，同一查询直接取缓存结果；采集 cProfile 时就地重算一遍，才能采到这些开销
             formal_title = f"【{report_title_prefix}汇总】课时报表 ({f_start}至{f_end})"
-            excel_data = convert_df_to_excel_pro(pivot_df, sheet_name="数据汇总", title=formal_title)
-            st.download_button(
-                label=f"⬇️ 导出《{report_title_prefix}汇报表格》为 Excel",
-                data=excel_data, file_name=f"{report_title_prefix}课时报表_{f_start}至{f_end}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-            with st.expander("🔍 查看抓取底层明细 (用于排错)"): st.dataframe(stat_df)
-        else:
-            st.warning("⚠️ 在指定的范围中，未抓取到有效课时！")
+            col_lo, col_hi = st.session_state['g_start'] - 1, st.session_state['g_end'] - 1
+            if semester:
+                lesson_store = get_lesson_store()
+                store_info = lesson_store.summary()
+                key = ('semester', store_info['updated_at'], store_info['rows'], tuple(targets), col_lo, col_hi, f_start, f_end, PARSER_VERSION, formal_title)
+                job = get_report_jobs().submit(key, compute_semester_report, lesson_store, list(targets), col_lo, col_hi, f_start, f_end, "数据汇总", formal_title,
+                                               refresh=profiling, inline=profiling)
+            else:
+                job = submit_upload_report(targets, col_lo, col_hi, f_start, f_end, "数据汇总", formal_title,
+                                           refresh=profiling, inline=profiling)
+            with report_recorder.stage('wait_report'): result = await_report(job, "全局报表")
+            if result is not None and not result['stat_df'].empty:
+                report_recorder.stages.update(job['stages'])
+                stat_df, pivot_df = result['stat_df'], result['pivot_df']
+                st.success(f"🎉 统计完毕！共 {len(pivot_df)} 位老师上了课，总计 {pivot_df['总计'].sum()} 节。")
+                st.caption(result['query_note'])
+                st.dataframe(pivot_df, use_container_width=True)
+            
+                st.download_button(
+                    label=f"⬇️ 导出《{report_title_prefix}汇报表格》为 Excel",
+                    data=result['excel_data'], file_name=f"{report_title_prefix}课时报表_{f_start}至{f_end}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+                # 报表包在点击下载时才生成，不点就不占内存；Streamlit 只接受字节/BytesIO 等数据，生成的字节由它存进媒体缓存交给下载
+                # 用到的值全部以默认参数固定下来，之后的重跑改了这些变量也不影响这次下载
+                def build_report_bundle(pivot_df=pivot_df, stat_df=stat_df, targets=targets, semester=semester, col_lo=col_lo, col_hi=col_hi,
+                                        f_start=f_start, f_end=f_end, title_prefix=report_title_prefix, recorder=report_recorder):
+                    with recorder.stage('export_bundle'):
+                        if semester: stat_df = get_lesson_store().query_records(targets, f_start, f_end, col_lo, col_hi)
+                        bundle = io.BytesIO()
+                        write_report_bundle(bundle, pivot_df, stat_df, targets, title_prefix, f"{f_start}至{f_end}")
+                    return bundle.getvalue()
+                st.download_button(
+                    label=f"📦 导出完整报表包 (汇总 + {len(targets)} 个班级 + 明细)",
+                    data=build_report_bundle, file_name=f"{report_title_prefix}课时报表包_{f_start}至{f_end}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
+                with st.expander("🔍 查看抓取底层明细 (用于排错)"):
+                    if semester and len(stat_df) == SEMESTER_PREVIEW_ROWS: st.caption(f"仅显示前 {SEMESTER_PREVIEW_ROWS} 条，完整明细请导出报表包")
+                    st.dataframe(stat_df)
+            elif result is not None:
+                st.warning("⚠️ 在指定的范围中，未抓取到有效课时！")
             
     else:
         current = st.session_state['current_sheet']
         st.markdown(f"<h4 style='color:#1e3c72;'>👁️ 当前查看 : 【 {current} 】</h4>", unsafe_allow_html=True)
         
-        df_current = st.session_state['all_sheets'][current].copy()
-        display_df = df_current.astype(str).replace({' 00:00:00': ''}, regex=True).replace({'nan': '', 'None': ''})
-        st.dataframe(display_df, use_container_width=True, height=350)
+        # 会话里存的是紧凑的分类编码表，这里只读不改；预览只格式化当前页，等下面本班统计页选好日期段再渲染 (日期行跳转要用)
+        df_current = st.session_state['all_sheets'][current]
+        preview_box = st.container()
 
         st.markdown("---")
         tab1, tab2 = st.tabs(["📏 【周课表专用】垂直穿插统计", "📊 【常规明细表】手动选列统计"])
         
         with tab1:
-            all_cols = display_df.columns.tolist()
+            all_cols = df_current.columns.tolist()
             col_a, col_b = st.columns(2)
             with col_a: start_choice = st.selectbox("🚩 起始列", options=all_cols, index=14 if len(all_cols)>14 else 0)
             with col_b: end_choice = st.selectbox("🏁 结束列", options=all_cols, index=20 if len(all_cols)>20 else len(all_cols)-1)
                 
             start_idx, end_idx = all_cols.index(start_choice), all_cols.index(end_choice)
             if start_idx <= end_idx:
-                locked_cols = all_cols[start_idx : end_idx + 1]
-                all_dates_in_range = set()
-                for col in locked_cols:
-                    for val in display_df[col]:
-                        m = re.search(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', str(val).strip())
-                        if m:
-                            try: all_dates_in_range.add(pd.to_datetime(m.group(1)).date())
-                            except: pass
+                date_span = span_dates(get_date_cells(current), start_idx, end_idx)
                 
-                if all_dates_in_range:
-                    min_d, max_d = min(all_dates_in_range), max(all_dates_in_range)
+                if date_span:
+                    min_d, max_d = date_span
                     date_range = st.date_input(f"🗓️ 选择提取区间：", [min_d, max_d])
                     
                     if len(date_range) >= 1:
                         f_start = date_range[0]
                         f_end = date_range[1] if len(date_range) == 2 else date_range[0]
+                        st.session_state['class_dates'] = (current, start_idx, end_idx, f_start, f_end)
                         
+                        # 同样的班级、列窗口和日期段算过一次就留在缓存里，切走再回来或调别的控件都直接显示，不必再点
+                        formal_title = f"【{current}】课时统计报表 ({f_start}至{f_end})"
                         if st.button("🚀 开始本班扫描提取", type="primary"):
-                            records = []
-                            for col in locked_cols:
-                                current_date = None
-                                for val in display_df[col]:
-                                    val_str = str(val).strip()
-                                    m = re.search(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', val_str)
-                                    if m:
-                                        try: current_date = pd.to_datetime(m.group(1)).date()
-                                        except: pass
-                                        continue
-                                    
-                                    if current_date and (f_start <= current_date <= f_end):
-                                        parsed = parse_class_string(val_str)
-                                        if parsed: records.append(parsed)
-                                            
-                            if records:
-                                stat_df = pd.DataFrame(records)
-                                pivot_df = pd.pivot_table(stat_df, values='课时数', index='教师姓名', columns='课程类别', aggfunc='sum', fill_value=0)
-                                pivot_df['总计'] = pivot_df.sum(axis=1)
-                                
-                                st.success(f"🎉 统计完毕！【{current}】共计 {stat_df['课时数'].sum()} 节课时。")
-                                st.dataframe(pivot_df, use_container_width=True)
-                                
-                                formal_title = f"【{current}】课时统计报表 ({f_start}至{f_end})"
-                                excel_data = convert_df_to_excel_pro(pivot_df, sheet_name=current, title=formal_title)
-                                st.download_button(
-                                    label=f"⬇️ 导出带商务排版的《{current}报表》",
-                                    data=excel_data, file_name=f"{current}_课时报表_{f_start}至{f_end}.xlsx",
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                )
-                                with st.expander("🔍 提取明细"): st.dataframe(stat_df)
-                            else:
-                                st.warning("未找到可识别的课时。")
+                            get_lesson_facts(current)
+                            submit_upload_report([current], start_idx, end_idx, f_start, f_end, current, formal_title)
+                        job = get_report_jobs().get(upload_report_key([current], start_idx, end_idx, f_start, f_end, current, formal_title))
+                        result = await_report(job, "本班报表") if job is not None else None
+                        if result is not None and not result['stat_df'].empty:
+                            stat_df, pivot_df = result['stat_df'][LESSON_COLS], result['pivot_df']
+                            st.success(f"🎉 统计完毕！【{current}】共计 {stat_df['课时数'].sum()} 节课时。")
+                            st.caption(result['query_note'])
+                            st.dataframe(pivot_df, use_container_width=True)
+                            
+                            st.download_button(
+                                label=f"⬇️ 导出带商务排版的《{current}报表》",
+                                data=result['excel_data'], file_name=f"{current}_课时报表_{f_start}至{f_end}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                            )
+                            with st.expander("🔍 提取明细"): st.dataframe(stat_df)
+                        elif result is not None:
+                            st.warning("未找到可识别的课时。")
                 else:
                     st.warning("⚠️ 没有扫描到包含日期的行！")
 
         with tab2:
-            available_cols = list(display_df.columns)
+            available_cols = list(df_current.columns)
             def guess_index(kw):
                 for i, c in enumerate(available_cols):
                     if any(k in str(c) for k in kw): return i
@@ -451,7 +798,7 @@ if st.session_state['all_sheets'] is not None:
                 
             if st.button("📊 生成常规统计"):
                 try:
-                    stat_df = df_current.copy()
+                    stat_df = expand_frame(df_current)
                     stat_df[count_col] = pd.to_numeric(stat_df[count_col], errors='coerce').fillna(0)
                     stat_df = stat_df[stat_df[name_col].notna()]
                     stat_df = stat_df[stat_df[name_col].astype(str).str.strip() != '']
@@ -460,12 +807,16 @@ if st.session_state['all_sheets'] is not None:
                     st.dataframe(pivot_df, use_container_width=True)
                     
                     formal_title = f"【{current}】常规课时统计"
-                    excel_data = convert_df_to_excel_pro(pivot_df, sheet_name=current, title=formal_title)
+                    excel_data = convert_df_to_excel_stream(pivot_df, sheet_name=current, title=formal_title)
                     st.download_button(
                         label="⬇️ 导出带高级排版的报表", data=excel_data, file_name=f"{current}_常规课时.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
                 except:
                     st.warning("无法生成，请确认选对了列名！")
+
+        with preview_box: render_preview(current)
+
+    if show_diagnostics: render_diagnostics()
 else:
     st.info("👆 请先在左侧上传您的 Excel 文件！")
\ No newline at end of file
@@ -0,0 +1,93 @@
+# 导出引擎基准：同一张明细表分别用 convert_df_to_excel_pro (逐格设样式) 和
+# convert_df_to_excel_stream (流式写入、样式复用) 导出，对比耗时、Python 内存峰值，并抽查两份文件版式是否一致
+#
+#   python benchmarks/bench_export.py --rows 50000
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import io
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import convert_df_to_excel_pro, convert_df_to_excel_stream, EXCEL_WRITE_ENGINE
+
+def make_detail_table(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    teachers = np.array([f"教师{i:03d}" for i in range(120)])
+    categories = np.array(['常规课', '早自', '晚自', '正课', '辅导', '高一', '高二', '高三'])
+    classes = np.array([f"高{g}{c}班" for g in '一二三' for c in range(1, 15)])
+    dates = pd.date_range('2024-09-01', periods=120).strftime('%Y-%m-%d').values
+    return pd.DataFrame({
+        '教师姓名': teachers[rng.integers(0, len(teachers), rows)],
+        '课程类别': categories[rng.integers(0, len(categories), rows)],
+        '课时数': rng.choice([1.0, 1.0, 1.0, 2.0, 0.5], rows),
+        '来源班级': classes[rng.integers(0, len(classes), rows)],
+        '来源日期': dates[rng.integers(0, len(dates), rows)],
+    })
+
+# 计时与内存分两遍跑：tracemalloc 本身会把纯 Python 代码拖慢数倍
+def measure(fn, df):
+    t0 = time.perf_counter()
+    data = fn(df, sheet_name="数据明细", title="【基准】课时明细")
+    seconds = time.perf_counter() - t0
+    tracemalloc.start()
+    fn(df, sheet_name="数据明细", title="【基准】课时明细")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return data, seconds, peak
+
+# 颜色只比 RGB (两种后端写出的 alpha 字节不同，Excel 不使用)，未显式指定的字号按默认 11 号比较
+def cell_look(cell):
+    rgb = lambda color: color.rgb[-6:] if color is not None and isinstance(color.rgb, str) else None
+    return (cell.value if cell.value != '' else None, bool(cell.font.b), cell.font.sz or 11.0, rgb(cell.font.color),
+            rgb(cell.fill.fgColor) if cell.fill.fill_type else None, cell.alignment.horizontal, cell.alignment.vertical,
+            cell.border.left.style, cell.border.bottom.style)
+
+# 列宽可能按单列或按列区间记录，统一换算到每一列
+def column_width(ws, c):
+    for dim in ws.column_dimensions.values():
+        if dim.min and dim.max and dim.min <= c <= dim.max: return dim.width
+    return None
+
+# 抽查标题、表头、首列/普通列、首尾数据行的值与样式，以及合并区域、行高、列宽
+def compare_look(a_bytes, b_bytes, rows):
+    a, b = load_workbook(io.BytesIO(a_bytes)).active, load_workbook(io.BytesIO(b_bytes)).active
+    diffs = []
+    if a.merged_cells.ranges != b.merged_cells.ranges: diffs.append("merged")
+    for r in [1, 3, 4, 5, rows + 3]:
+        if a.row_dimensions[r].height != b.row_dimensions[r].height: diffs.append(f"height r{r}")
+        for c in range(1, a.max_column + 1):
+            if cell_look(a.cell(r, c)) != cell_look(b.cell(r, c)): diffs.append(f"cell r{r}c{c}")
+    for c in range(1, a.max_column + 1):
+        if column_width(a, c) != column_width(b, c): diffs.append(f"width c{c}")
+    return diffs
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel 导出引擎基准")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--skip-check', action='store_true', help="跳过版式抽查 (大表回读本身也慢)")
+    args = parser.parse_args()
+
+    df = make_detail_table(args.rows)
+    results = {}
+    candidates = [('convert_df_to_excel_pro', convert_df_to_excel_pro),
+                  ('stream[openpyxl]', partial(convert_df_to_excel_stream, engine='openpyxl'))]
+    if EXCEL_WRITE_ENGINE == 'xlsxwriter': candidates.append(('stream[xlsxwriter]', partial(convert_df_to_excel_stream, engine='xlsxwriter')))
+    for name, fn in candidates:
+        data, seconds, peak = measure(fn, df)
+        results[name] = data
+        print(f"{name:<28} {seconds:8.2f} s   峰值 {peak / 1024 / 1024:8.1f} MB   文件 {len(data) / 1024:8.0f} KB")
+
+    if not args.skip_check:
+        for name in list(results)[1:]:
+            diffs = compare_look(results['convert_df_to_excel_pro'], results[name], args.rows)
+            print(f"{name}: " + ("版式一致" if not diffs else f"版式差异 {diffs}"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# 端到端流水线基准：用合成课表逐段计时 (Excel 读取、clean_excel_data、日期锚定、单元格解析、汇总透视、导出)，
+# 每段单独记录耗时与 Python 内存峰值，结果写成 JSON，便于不同提交之间对比
+#
+#   python benchmarks/bench_pipeline.py --classes 30 --weeks 18
+#   python benchmarks/bench_pipeline.py --compare benchmarks/results/上一次.json
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+import tracemalloc
+from collections import OrderedDict
+try: import resource  # Windows 上没有，进程内存高水位记为 None
+except ImportError: resource = None
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from engine import (clean_excel_data, anchor_dates, parse_class_series, build_lesson_facts, read_workbook, valid_class_sheets,
+                    collect_report_records, pivot_lessons, decode_dates, LessonIndex, convert_df_to_excel_pro, convert_df_to_excel_stream,
+                    EXCEL_READ_ENGINE, EXCEL_WRITE_ENGINE, INGEST_WORKERS, PARSER_VERSION)
+from synth_workbook import book_bytes, add_generator_args, generator_kwargs
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+# 每段先跑 repeat 次取中位数计时，再在 tracemalloc 下单独跑一次量内存峰值 (tracemalloc 会拖慢纯 Python 代码)
+class StageTimer:
+    def __init__(self, repeat, track_memory=True):
+        self.repeat, self.track_memory = repeat, track_memory
+        self.stages = OrderedDict()
+
+    def run(self, name, fn):
+        runs = []
+        for _ in range(self.repeat):
+            t0 = time.perf_counter(); result = fn(); runs.append(time.perf_counter() - t0)
+        peak = None
+        if self.track_memory:
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        self.stages[name] = {'seconds': round(statistics.median(runs), 4), 'runs': [round(r, 4) for r in runs],
+                             'peak_mb': None if peak is None else round(peak, 2)}
+        print(f"  {name:<16} {self.stages[name]['seconds']:>9.3f}s" + ('' if peak is None else f"  峰值 {peak:>8.1f} MB"), flush=True)
+        return result
+
+# 本进程 (不含读取用的子进程) 的常驻内存高水位；ru_maxrss 在 Linux 上以 KB、macOS 上以字节计
+def max_rss_mb():
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+def run_pipeline(file_bytes, timer):
+    raw = timer.run('read_excel', lambda: pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, engine=EXCEL_READ_ENGINE))
+    # clean_excel_data 会改写传入表的列名，每次都给一份浅拷贝
+    clean = timer.run('clean', lambda: {name: clean_excel_data(df.copy(deep=False)) for name, df in raw.items()})
+    anchored = timer.run('anchor_dates', lambda: {name: anchor_dates(df) for name, df in clean.items()})
+    timer.run('parse_cells', lambda: {name: parse_class_series(pd.Series(cells, dtype=object)) for name, (_, _, cells, _) in anchored.items()})
+    facts = timer.run('build_facts', lambda: {name: build_lesson_facts(name, df) for name, df in clean.items()})
+    # 应用实际走的并行全流程 (读取 + 清洗 + 事实表)；解析在子进程里进行，这一段的内存峰值只含主进程
+    timer.run('read_workbook', lambda: read_workbook(file_bytes))
+
+    targets = valid_class_sheets(facts)
+    all_facts = pd.concat([facts[t] for t in targets], ignore_index=True)
+    f_start, f_end = decode_dates([all_facts['来源日期'].min(), all_facts['来源日期'].max()])
+    col_hi = int(all_facts['列序号'].max())
+    stat_df = timer.run('select_records', lambda: collect_report_records(facts, targets, 0, col_hi, f_start, f_end))
+    pivot_df = timer.run('pivot_table', lambda: pivot_lessons(stat_df))
+    index = timer.run('index_build', lambda: LessonIndex(all_facts, 0, col_hi))
+    timer.run('index_pivot', lambda: index.pivot(f_start, f_end, sheets=targets))
+    timer.run('export_pro', lambda: convert_df_to_excel_pro(stat_df, sheet_name="数据明细", title="【基准】课时明细"))
+    timer.run('export_stream', lambda: convert_df_to_excel_stream(stat_df, sheet_name="数据明细", title="【基准】课时明细"))
+    return {'sheets': len(raw), 'class_sheets': len(targets), 'cells': int(sum(df.size for df in raw.values())),
+            'fact_rows': len(all_facts), 'detail_rows': len(stat_df), 'teachers': len(pivot_df), 'date_min': str(f_start), 'date_max': str(f_end)}
+
+def print_comparison(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f: baseline = json.load(f)
+    print(f"\n与 {baseline_path} (提交 {baseline.get('git_commit')}) 对比：")
+    for name, stage in current['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old: print(f"  {name:<16} (基线无此阶段)"); continue
+        ratio = stage['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        mem = ''
+        if stage['peak_mb'] is not None and old.get('peak_mb'): mem = f"  内存 {old['peak_mb']:.1f} -> {stage['peak_mb']:.1f} MB"
+        print(f"  {name:<16} {old['seconds']:>8.3f}s -> {stage['seconds']:>8.3f}s  ×{ratio:.2f}{mem}")
+
+def main():
+    parser = argparse.ArgumentParser(description="课时统计端到端流水线基准")
+    add_generator_args(parser)
+    parser.add_argument('--repeat', type=int, default=3, help="每段计时重复次数 (取中位数)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="跳过 tracemalloc 内存峰值测量")
+    parser.add_argument('--out', help="结果 JSON 路径 (默认 benchmarks/results/pipeline_时间戳.json)")
+    parser.add_argument('--compare', help="与之前的结果 JSON 对比")
+    args = parser.parse_args()
+
+    config = generator_kwargs(args)
+    t0 = time.perf_counter()
+    file_bytes = book_bytes(**config)
+    print(f"合成工作簿：{args.classes} 个班级 × {args.weeks} 周 × 每天 {args.periods} 节 ({args.layout}, {len(file_bytes) / 1024:.0f} KB, 生成 {time.perf_counter() - t0:.1f}s)")
+
+    timer = StageTimer(args.repeat, args.memory)
+    workload = run_pipeline(file_bytes, timer)
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__, 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'read_engine': EXCEL_READ_ENGINE, 'write_engine': EXCEL_WRITE_ENGINE,
+                        'ingest_workers': INGEST_WORKERS, 'parser_version': PARSER_VERSION},
+        'config': dict(config, workbook_bytes=len(file_bytes), repeat=args.repeat),
+        'workload': workload,
+        'stages': timer.stages,
+        'max_rss_mb': max_rss_mb(),
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"pipeline_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f: json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n明细 {workload['detail_rows']} 行，进程内存高水位 {result['max_rss_mb']} MB，结果已写入 {out}")
+    if args.compare: print_comparison(result, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# 合成课表工作簿生成器：按班级数、周数、每天节数、日期行版式和单元格格式配比造出与真实课表结构相同的 .xlsx，
+# 供 bench_pipeline.py 等基准使用，也可单独运行生成文件手工测试
+#
+#   python benchmarks/synth_workbook.py --classes 30 --weeks 18 --out /tmp/课表.xlsx
+#
+# 版式 (--layout)：
+#   stacked  各周上下堆叠：每周一块，「第N周」行 + 日期行 + 每节一行，所有周共用第 2-8 列
+#   side     各周左右并排：每周占 7 列，星期行下面就是日期行，再下面每节一行 (第 k 周在第 7k-5 到 7k+1 列)
+# 日期格式 (--date-style)：datetime 原生日期 / text「2024-09-02」/ slash「2024/9/2」/ mixed 三种混用
+import io
+import random
+import datetime
+import argparse
+
+import pandas as pd
+
+WEEKDAYS = ['星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日']
+CN_NUMS = '一二三四五六七八九十'
+TEACHERS = ['张伟', '王芳', '李娜', '刘洋', '陈静', '杨磊', '赵敏', '黄涛', '周杰', '吴霞', '徐亮', '孙丽', '马超', '朱琳', '胡斌',
+            '郭婷', '何军', '林峰', '高翔', '罗雪']
+GRADES = ['高一', '高二', '高三']
+SUFFIXES = ['早自', '晚自', '正课', '辅导', '早读', '晚修', '正大', '正小', '自大', '自小']
+IGNORED = ['体育', '班会', '国学', '美术', '音乐', '大扫除', '0']
+
+# 单元格格式配比 (权重)，对应 parse_class_string 的各条识别分支
+DEFAULT_MIX = {'grade': 3, 'suffix': 3, 'count': 2, 'plain': 3, 'ignore': 1, 'blank': 2}
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or '').split(',')):
+        key, _, weight = part.partition('=')
+        if key.strip() not in mix: raise ValueError(f"未知的单元格类型：{key}")
+        mix[key.strip()] = float(weight)
+    return mix
+
+def cn_num(n):
+    if n <= 10: return CN_NUMS[n - 1]
+    return ('' if n < 20 else CN_NUMS[n // 10 - 1]) + '十' + (CN_NUMS[n % 10 - 1] if n % 10 else '')
+
+def make_cell(rnd, kinds, weights):
+    kind = rnd.choices(kinds, weights)[0]
+    teacher = rnd.choice(TEACHERS)
+    if kind == 'grade': return f"{teacher}{rnd.choice(GRADES)}{rnd.randint(1, 12)}"
+    if kind == 'suffix': return teacher + rnd.choice(SUFFIXES)
+    if kind == 'count': return f"{teacher}{rnd.choice(['', '正课', '晚自'])}{rnd.choice(['2', '1.5', '0.5', '3'])}"
+    if kind == 'plain': return teacher
+    if kind == 'ignore': return rnd.choice(IGNORED)
+    return None
+
+def make_date(rnd, day, style):
+    if style == 'mixed': style = rnd.choice(['datetime', 'text', 'slash'])
+    if style == 'datetime': return datetime.datetime(day.year, day.month, day.day)
+    if style == 'slash': return f"{day.year}/{day.month}/{day.day}"
+    return day.isoformat()
+
+# 与真实课表一样，首行是表标题 (读入后成为列名)，星期行在数据区里
+def make_sheet(seed, weeks=4, periods=8, layout='stacked', date_style='mixed', mix=None, start=datetime.date(2024, 9, 2), title='课程表'):
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = list(mix), list(mix.values())
+    day = lambda w, d: start + datetime.timedelta(days=w * 7 + d)
+    if layout == 'stacked':
+        rows = [['节次'] + WEEKDAYS]
+        for w in range(weeks):
+            rows.append([f"第{cn_num(w + 1)}周"] + [None] * 7)
+            rows.append([None] + [make_date(rnd, day(w, d), date_style) for d in range(7)])
+            for p in range(periods):
+                rows.append([f"第{p + 1}节"] + [make_cell(rnd, kinds, weights) if d < 5 else None for d in range(7)])
+    elif layout == 'side':
+        rows = [['节次'] + WEEKDAYS * weeks]
+        rows.append([None] + [make_date(rnd, day(w, d), date_style) for w in range(weeks) for d in range(7)])
+        for p in range(periods):
+            rows.append([f"第{p + 1}节"] + [make_cell(rnd, kinds, weights) if d < 5 else None for w in range(weeks) for d in range(7)])
+    else:
+        raise ValueError(f"未知的版式：{layout}")
+    return pd.DataFrame(rows, columns=[title] + [None] * (len(rows[0]) - 1))
+
+# 班级表按年级平均分配，另外附一张会被统计排除的「总表」
+def make_book(classes=12, seed=0, **kw):
+    sheets = {}
+    for i in range(classes):
+        grade = GRADES[i % len(GRADES)]
+        name = f"{grade}{i // len(GRADES) + 1}班"
+        sheets[name] = make_sheet(seed * 100003 + i, title=f"{name}课程表", **kw)
+    sheets['总表'] = pd.DataFrame({'姓名': TEACHERS, '类别': '常规课', '课数': 0})
+    return sheets
+
+def book_bytes(classes=12, seed=0, **kw):
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine='openpyxl') as writer:
+        for name, df in make_book(classes, seed, **kw).items(): df.to_excel(writer, sheet_name=name, index=False)
+    return bio.getvalue()
+
+def add_generator_args(p):
+    p.add_argument('--classes', type=int, default=12, help="班级表数量")
+    p.add_argument('--weeks', type=int, default=4, help="每张表的周数")
+    p.add_argument('--periods', type=int, default=8, help="每天节数")
+    p.add_argument('--layout', choices=['stacked', 'side'], default='stacked', help="日期行版式")
+    p.add_argument('--date-style', choices=['datetime', 'text', 'slash', 'mixed'], default='mixed', help="日期单元格格式")
+    p.add_argument('--mix', default='', help="单元格格式配比，如 grade=3,suffix=3,count=2,plain=3,ignore=1,blank=2")
+    p.add_argument('--seed', type=int, default=0)
+
+def generator_kwargs(args):
+    return {'classes': args.classes, 'seed': args.seed, 'weeks': args.weeks, 'periods': args.periods,
+            'layout': args.layout, 'date_style': args.date_style, 'mix': parse_mix(args.mix)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="生成合成课表工作簿")
+    add_generator_args(parser)
+    parser.add_argument('--out', default='synthetic_schedule.xlsx')
+    args = parser.parse_args()
+    data = book_bytes(**generator_kwargs(args))
+    with open(args.out, 'wb') as f: f.write(data)
+    print(f"已生成 {args.out} ({len(data) / 1024:.0f} KB, {args.classes} 个班级 × {args.weeks} 周)")
@@ -0,0 +1,96 @@
+# 命令行批量出表：不依赖 streamlit / plotly，直接调用 engine 里与网页共用的读取、统计和导出逻辑
+# 用法示例：python cli.py 课表目录 --from 2024-03-04 --to 2024-03-08 --grade 高一 --out 报表输出
+import argparse, datetime, hashlib, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from engine import (read_workbook, disk_cache_load, disk_cache_store, valid_class_sheets, collect_report_records,
+                    pivot_lessons, write_report_bundle)
+
+WORKBOOK_EXTS = ('.xlsx', '.xlsm')
+
+def find_workbooks(folder):
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(WORKBOOK_EXTS) and not n.startswith('~$'))
+    return [os.path.join(folder, n) for n in names]
+
+def parse_date(text):
+    try: return datetime.date.fromisoformat(text)
+    except ValueError: raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD：{text}")
+
+# 与网页侧边栏一致：先排除总表/汇总表，再按年级 (表名包含即可) 和班级名筛选
+def pick_targets(sheet_names, grades, classes):
+    targets = valid_class_sheets(sheet_names)
+    if grades: targets = [s for s in targets if any(g in s for g in grades)]
+    if classes: targets = [s for s in targets if s in classes]
+    return targets
+
+def load_facts(path, use_cache):
+    with open(path, 'rb') as f: file_bytes = f.read()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    cached = disk_cache_load(file_hash) if use_cache else None
+    if cached is not None: return cached[1], 'disk'
+    # 文件之间已经并行，这里逐表读取，避免进程池里再套进程池
+    clean_sheets, lesson_facts, date_cells = read_workbook(file_bytes, parallel=False)
+    if use_cache: disk_cache_store(file_hash, clean_sheets, lesson_facts, date_cells)
+    return lesson_facts, 'excel'
+
+# 单个文件的完整流程 (在子进程里跑)：读取 -> 筛表 -> 取课 -> 写该文件的报表包
+def process_workbook(path, args):
+    t0 = time.perf_counter()
+    lesson_facts, source = load_facts(path, args.cache)
+    targets = pick_targets(list(lesson_facts), args.grades, args.classes)
+    stat_df = collect_report_records(lesson_facts, targets, args.start_col - 1, args.end_col - 1, args.date_from, args.date_to)
+    out_path = None
+    if not stat_df.empty:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        out_path = os.path.join(args.out, f"{stem}_课时报表包_{args.period}.xlsx")
+        with open(out_path, 'wb') as f: write_report_bundle(f, pivot_lessons(stat_df), stat_df, targets, stem, args.period)
+    return stat_df.assign(来源文件=os.path.basename(path)), targets, out_path, source, time.perf_counter() - t0
+
+def build_parser():
+    p = argparse.ArgumentParser(description="批量统计课表目录下所有工作簿的教师课时，输出汇总 + 分班 + 明细报表包")
+    p.add_argument('folder', help="存放课表 (.xlsx/.xlsm) 的目录")
+    p.add_argument('--from', dest='date_from', type=parse_date, required=True, help="起始日期 YYYY-MM-DD")
+    p.add_argument('--to', dest='date_to', type=parse_date, help="结束日期 YYYY-MM-DD (默认与起始日期相同)")
+    p.add_argument('--start-col', type=int, default=15, help="统计起始列号，从 1 开始 (默认 15)")
+    p.add_argument('--end-col', type=int, default=21, help="统计结束列号，含该列 (默认 21)")
+    p.add_argument('--grade', dest='grades', action='append', help="只统计表名含该年级的班级 (如 高三)，可重复指定")
+    p.add_argument('--class', dest='classes', action='append', help="只统计该班级 (工作表名)，可重复指定")
+    p.add_argument('--out', default='报表输出', help="报表输出目录 (默认 ./报表输出)")
+    p.add_argument('--workers', type=int, default=max(1, min(4, os.cpu_count() or 1)), help="同时处理的文件数")
+    p.add_argument('--no-cache', dest='cache', action='store_false', help="不读写落盘缓存，每次都重新解析 Excel")
+    return p
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.date_to = args.date_to or args.date_from
+    if args.date_to < args.date_from: args.date_from, args.date_to = args.date_to, args.date_from
+    if args.start_col < 1 or args.end_col < args.start_col: print("❌ 列号范围不合法", file=sys.stderr); return 2
+    args.period = f"{args.date_from}至{args.date_to}"
+    paths = find_workbooks(args.folder)
+    if not paths: print(f"❌ 目录中没有找到课表文件：{args.folder}", file=sys.stderr); return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    results, failed = {}, 0
+    workers = max(1, min(args.workers, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_workbook, path, args): path for path in paths}
+        for fut in as_completed(futures):
+            name = os.path.basename(futures[fut])
+            try: stat_df, targets, out_path, source, cost = fut.result()
+            except Exception as e: failed += 1; print(f"❌ {name}: {e}", file=sys.stderr); continue
+            results[futures[fut]] = (stat_df, targets)
+            where = out_path if out_path else "该时段内没有课时记录，未输出"
+            print(f"✅ {name} ({'缓存' if source == 'disk' else '解析'} {cost:.1f}s, {len(targets)} 个班级, {stat_df['课时数'].sum()} 节) -> {where}")
+
+    # 多个文件时再合并出一份总报表包 (同名班级跨文件合并统计)
+    frames = [results[p][0] for p in paths if p in results and not results[p][0].empty]
+    if len(paths) > 1 and frames:
+        all_df = pd.concat(frames, ignore_index=True)
+        classes = list(dict.fromkeys(s for p in paths if p in results for s in results[p][1]))
+        out_path = os.path.join(args.out, f"全部文件课时报表包_{args.period}.xlsx")
+        with open(out_path, 'wb') as f: write_report_bundle(f, pivot_lessons(all_df), all_df, classes, "全部文件", args.period)
+        print(f"📦 合并报表 ({len(frames)} 个文件, {all_df['教师姓名'].nunique()} 位老师, {all_df['课时数'].sum()} 节) -> {out_path}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,961 @@
+import pandas as pd
+import numpy as np
+import io
+import datetime
+import os
+import sys
+import json
+import logging
+import time
+import shutil
+import hashlib
+import inspect
+import functools
+import re
+import contextlib
+import tempfile
+import sqlite3
+import threading
+import weakref
+import importlib.util
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, as_completed
+from copy import copy
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+# ================= 耗时诊断 =================
+# 各阶段耗时与逐表开销以一行 JSON 写进 keshi 日志 (便于 grep / 导入分析)，界面上的诊断面板读同一份记录
+logger = logging.getLogger('keshi')
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get('KESHI_LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+def log_event(event, **fields):
+    logger.info(json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+def elapsed_ms(t0):
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+# 一次运行 (一次上传解析、一次报表生成) 的记录：stages 为 {阶段: 累计毫秒}，sheets 为 {表名: 逐表开销}
+# 逐表开销可以传入同一个字典让几次运行共用，表只会被解析一次，开销也就只出现在首次解析它的那次运行里
+class StageRecorder:
+    def __init__(self, run, sheets=None):
+        self.run = run
+        self.stages = OrderedDict()
+        self.sheets = sheets if sheets is not None else OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.add_stage(name, elapsed_ms(t0))
+
+    def add_stage(self, name, ms):
+        self.stages[name] = round(self.stages.get(name, 0.0) + ms, 2)
+        log_event('stage', run=self.run, stage=name, ms=ms)
+
+    def add_sheet(self, name, stats):
+        self.sheets[name] = stats
+        log_event('sheet', run=self.run, sheet=name, **stats)
+
+# ================= 汇报级 Excel 渲染引擎 =================
+def convert_df_to_excel_pro(df, sheet_name, title):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        export_df = df.reset_index()
+        export_df.to_excel(writer, sheet_name=sheet_name, startrow=2, index=False)
+        worksheet = writer.sheets[sheet_name]
+        
+        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        header_fill = PatternFill(start_color="1E3C72", end_color="1E3C72", fill_type="solid") # 换成更高级的深蓝表头
+        header_font = Font(color="FFFFFF", bold=True, size=11)
+        center_align = Alignment(horizontal='center', vertical='center')
+        
+        max_col = len(export_df.columns)
+        max_row = len(export_df) + 3 
+        
+        cell = worksheet.cell(row=1, column=1, value=title)
+        cell.font = Font(size=18, bold=True, color="000000")
+        worksheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=max_col)
+        cell.alignment = center_align
+        worksheet.row_dimensions[1].height = 40 
+        
+        worksheet.row_dimensions[3].height = 25
+        for col_idx in range(1, max_col + 1):
+            c = worksheet.cell(row=3, column=col_idx)
+            c.fill = header_fill
+            c.font = header_font
+            c.alignment = center_align
+            c.border = thin_border
+            
+        for r_idx in range(4, max_row + 1):
+            worksheet.row_dimensions[r_idx].height = 20 
+            for c_idx in range(1, max_col + 1):
+                c = worksheet.cell(row=r_idx, column=c_idx)
+                c.alignment = center_align
+                c.border = thin_border
+                if c_idx == 1: c.font = Font(bold=True)
+                    
+        for i in range(1, max_col + 1):
+            worksheet.column_dimensions[get_column_letter(i)].width = 15 
+
+    return output.getvalue()
+
+# 流式导出：与 convert_df_to_excel_pro 版式一致 (标题合并、深蓝表头、细边框、列宽行高)，但每种样式只定义一次、逐行流式写出。
+# 装了 xlsxwriter 就用它的 constant_memory 模式，否则用 openpyxl 的 write_only 模式
+EXCEL_WRITE_ENGINE = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+
+def convert_df_to_excel_stream(df, sheet_name, title, engine=None):
+    if isinstance(df.reset_index().columns, pd.MultiIndex): return convert_df_to_excel_pro(df, sheet_name, title)
+    output = io.BytesIO()
+    write_excel_sheets(output, [(sheet_name, df, title)], engine=engine)
+    return output.getvalue()
+
+# 把若干 (表名, DataFrame, 标题) 依次流式写进同一本工作簿，样式/格式对整本工作簿只建一次
+# fileobj 可以是任意可写的二进制文件对象，大文件直接写临时文件即可，不必在内存里留整份
+def write_excel_sheets(fileobj, sheets, engine=None):
+    if (engine or EXCEL_WRITE_ENGINE) == 'xlsxwriter':
+        import xlsxwriter
+        wb = xlsxwriter.Workbook(fileobj, {'constant_memory': True, 'strings_to_urls': False})
+        formats = build_xlsxwriter_formats(wb)
+        for sheet_name, df, title in sheets: write_sheet_xlsxwriter(wb, df.reset_index(), sheet_name, title, formats)
+        wb.close()
+    else:
+        wb = Workbook(write_only=True)
+        styles = None
+        for sheet_name, df, title in sheets: styles = write_sheet_openpyxl(wb, df.reset_index(), sheet_name, title, styles)
+        wb.save(fileobj)
+
+def body_values(export_df):
+    return export_df.astype(object).where(export_df.notna(), None).itertuples(index=False, name=None)
+
+# ---- xlsxwriter 后端 ----
+def build_xlsxwriter_formats(wb):
+    center = {'align': 'center', 'valign': 'vcenter'}
+    cell = dict(center, border=1)
+    formats = {
+        'title': wb.add_format(dict(center, bold=True, font_size=18, font_color='#000000')),
+        'header': wb.add_format(dict(cell, bold=True, font_size=11, font_color='#FFFFFF', bg_color='#1E3C72', pattern=1)),
+    }
+    # 与 pandas.to_excel 的默认日期格式保持一致
+    for kind, num_format in [('', None), ('_datetime', 'YYYY-MM-DD HH:MM:SS'), ('_date', 'YYYY-MM-DD')]:
+        extra = {'num_format': num_format} if num_format else {}
+        formats['first' + kind] = wb.add_format(dict(cell, bold=True, **extra))
+        formats['body' + kind] = wb.add_format(dict(cell, **extra))
+    return formats
+
+def write_sheet_xlsxwriter(wb, export_df, sheet_name, title, formats):
+    ws = wb.add_worksheet(sheet_name)
+    max_col = len(export_df.columns)
+    # openpyxl 的 width=15 是原始列宽，xlsxwriter 会自动补上字符边距，按像素设置才能得到同样的 15
+    ws.set_column_pixels(0, max_col - 1, 15 * 7)
+    ws.set_row(0, 40)
+    if max_col > 1: ws.merge_range(0, 0, 0, max_col - 1, title, formats['title'])
+    else: ws.write(0, 0, title, formats['title'])
+    ws.set_row(2, 25)
+    for c_idx, label in enumerate(export_df.columns): ws.write(2, c_idx, label, formats['header'])
+    for r_idx, row in enumerate(body_values(export_df), start=3):
+        ws.set_row(r_idx, 20)
+        for c_idx, value in enumerate(row):
+            kind = 'first' if c_idx == 0 else 'body'
+            if isinstance(value, datetime.datetime): kind += '_datetime'
+            elif isinstance(value, datetime.date): kind += '_date'
+            ws.write(r_idx, c_idx, value, formats[kind])
+    return ws
+
+# ---- openpyxl write_only 后端 ----
+# 样式索引是整本工作簿共用的，第一张表建好的 styles 原样传给后面的表；返回 styles 供下一张表复用
+def write_sheet_openpyxl(wb, export_df, sheet_name, title, styles=None):
+    worksheet = wb.create_sheet(sheet_name)
+    max_col = len(export_df.columns)
+    styles = styles or build_export_styles(worksheet)
+
+    for i in range(1, max_col + 1):
+        worksheet.column_dimensions[get_column_letter(i)].width = 15
+    worksheet.merged_cells.add(CellRange(min_col=1, min_row=1, max_col=max_col, max_row=1))
+
+    worksheet.row_dimensions[1].height = 40
+    worksheet.append([styled_cell(worksheet, title, styles['title'])])
+    worksheet.append([])
+    worksheet.row_dimensions[3].height = 25
+    worksheet.append([styled_cell(worksheet, c, styles['header']) for c in export_df.columns])
+    write_body_rows(worksheet, export_df, styles, start_row=4)
+    return styles
+
+def build_export_styles(worksheet):
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    center_align = Alignment(horizontal='center', vertical='center')
+    def template(**attrs):
+        cell = WriteOnlyCell(worksheet)
+        for k, v in attrs.items(): setattr(cell, k, v)
+        return cell._style
+    return {
+        'title': template(font=Font(size=18, bold=True, color="000000"), alignment=center_align),
+        'header': template(fill=PatternFill(start_color="1E3C72", end_color="1E3C72", fill_type="solid"),
+                           font=Font(color="FFFFFF", bold=True, size=11), alignment=center_align, border=thin_border),
+        'first': template(font=Font(bold=True), alignment=center_align, border=thin_border),
+        'body': template(alignment=center_align, border=thin_border),
+    }
+
+def styled_cell(worksheet, value, style):
+    cell = WriteOnlyCell(worksheet)
+    cell._style = copy(style)
+    cell.value = value
+    # 与 pandas.to_excel 的默认日期格式保持一致
+    if isinstance(value, datetime.datetime): cell.number_format = 'YYYY-MM-DD HH:MM:SS'
+    elif isinstance(value, datetime.date): cell.number_format = 'YYYY-MM-DD'
+    return cell
+
+# 行高只在写该行前登记、写完即删，内存占用与行数无关
+def write_body_rows(worksheet, export_df, styles, start_row):
+    first, body = styles['first'], styles['body']
+    for r_idx, row in enumerate(body_values(export_df), start=start_row):
+        worksheet.row_dimensions[r_idx].height = 20
+        worksheet.append([styled_cell(worksheet, row[0], first)] + [styled_cell(worksheet, v, body) for v in row[1:]])
+        del worksheet.row_dimensions[r_idx]
+
+# ================= 报表包导出 =================
+# 一本工作簿放齐：全校汇总透视、每个班一张透视、完整明细。
+# 各班透视都切自同一次 (班级, 教师, 类别) 分组求和，不再逐班重新扫描或逐班各渲染一个文件
+BUNDLE_SUMMARY_SHEET, BUNDLE_DETAIL_SHEET = "数据汇总", "数据明细"
+
+def build_class_pivots(stat_df, classes):
+    grouped = stat_df.groupby(['来源班级', '教师姓名', '课程类别'], sort=True)['课时数'].sum()
+    present = set(grouped.index.get_level_values(0))
+    pivots = {}
+    for name in classes:
+        if name not in present: continue
+        pivot_df = grouped.xs(name, level=0).unstack(fill_value=0)
+        pivot_df['总计'] = pivot_df.sum(axis=1)
+        pivots[name] = pivot_df
+    return pivots
+
+def write_report_bundle(fileobj, summary_pivot, stat_df, classes, title_prefix, period, engine=None):
+    sheets = [(BUNDLE_SUMMARY_SHEET, summary_pivot, f"【{title_prefix}汇总】课时报表 ({period})")]
+    for name, pivot_df in build_class_pivots(stat_df, classes).items():
+        if name in (BUNDLE_SUMMARY_SHEET, BUNDLE_DETAIL_SHEET): continue
+        sheets.append((name, pivot_df, f"【{name}】课时统计报表 ({period})"))
+    sheets.append((BUNDLE_DETAIL_SHEET, stat_df.set_index('教师姓名'), f"【{title_prefix}】课时抓取明细 ({period})"))
+    write_excel_sheets(fileobj, sheets, engine=engine)
+
+# ================= 智能识别与清洗引擎 =================
+def clean_excel_data(df):
+    is_schedule = False
+    for i in range(min(5, len(df))):
+        row_str = " ".join(str(x) for x in df.iloc[i].values)
+        if "星期" in row_str or re.search(r'\d{4}[-/]\d{2}[-/]\d{2}', row_str):
+            is_schedule = True; break
+            
+    if is_schedule:
+        new_cols = []
+        for idx, col in enumerate(df.columns):
+            c = str(col).strip()
+            if pd.isna(col) or c.lower() in ['nan', '', 'unnamed'] or 'unnamed' in c.lower(): c = f"未命名_{idx+1}"
+            base = c
+            counter = 1
+            while c in new_cols: c = f"{base}_{counter}"; counter += 1
+            new_cols.append(c)
+        df.columns = new_cols
+        return df.dropna(how='all', axis=1).dropna(how='all', axis=0)
+    else:
+        header_idx = -1
+        for i in range(min(10, len(df))):
+            if any(k in str(df.iloc[i].values) for k in ["姓名", "科目", "类别", "课数"]):
+                header_idx = i; break
+        if header_idx != -1:
+            raw_cols = df.iloc[header_idx].tolist()
+            df = df.iloc[header_idx + 1:].reset_index(drop=True)
+        else:
+            raw_cols = df.columns.tolist() 
+            new_cols = []
+            for idx, col in enumerate(raw_cols):
+                c = str(col).strip()
+                if pd.isna(col) or c.lower() in ['nan', '', 'unnamed'] or 'unnamed' in c.lower(): c = f"未命名_{idx+1}"
+                base = c
+                counter = 1
+                while c in new_cols: c = f"{base}_{counter}"; counter += 1
+                new_cols.append(c)
+            df.columns = new_cols
+        return df.dropna(how='all', axis=1).dropna(how='all', axis=0)
+
+
+# ================= 紧凑存储 =================
+# 每个会话都常驻整本工作簿，并发用户一多内存就成了上限：重复度高的文本列改为分类编码 (每种字符串只存一份 + 小整数编号)，
+# 事实表里日期存为 1970-01-01 起的天数 (int32)，列序号 int16，课时数保持 float64 (与 pivot_table 结果逐位一致，float32 会把 0.3 变成 0.30000001)；展示、导出时再按需还原
+CATEGORY_MAX_RATIO = 0.5
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def is_text_dtype(dtype):
+    return dtype == object or isinstance(dtype, pd.StringDtype)
+
+# 不同取值不超过行数一半的文本列转为分类列；单元格取值 (含日期、数字等原始对象) 原样保留，str() 结果不变
+def compact_frame(df):
+    df = df.copy(deep=False)
+    for i in range(len(df.columns)):
+        col = df.iloc[:, i]
+        if len(col) and is_text_dtype(col.dtype) and col.nunique() <= len(col) * CATEGORY_MAX_RATIO:
+            df.isetitem(i, col.astype('category'))
+    return df
+
+def expand_series(col):
+    return col.astype(col.cat.categories.dtype) if isinstance(col.dtype, pd.CategoricalDtype) else col
+
+# 还原为普通列 (分类列展开)，给需要完整 pandas 语义的场景 (to_numeric、pivot_table 等) 使用
+def expand_frame(df):
+    df = df.copy(deep=False)
+    for i in range(len(df.columns)):
+        if isinstance(df.iloc[:, i].dtype, pd.CategoricalDtype): df.isetitem(i, expand_series(df.iloc[:, i]).astype(object))
+    return df
+
+def date_code(d):
+    return int(np.datetime64(d, 'D').astype(np.int64))
+
+def decode_dates(codes):
+    return pd.Series(np.asarray(codes).astype('datetime64[D]'), dtype='datetime64[s]').dt.date
+
+# 界面预览用的字符串视图：分类列只对每个类别做一次字符串转换再按编号取值，不复制整表的单元格对象
+# 规则与原先 df.astype(str) 后去掉「 00:00:00」、把 nan/None 显示为空一致
+def display_strings(values):
+    return values.astype(str).replace({' 00:00:00': ''}, regex=True).replace({'nan': '', 'None': ''})
+
+def display_frame(df):
+    columns = {}
+    for i in range(len(df.columns)):
+        col = df.iloc[:, i]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # 末尾补一个缺失值，编号 -1 (空单元格) 正好取到它
+            labels = display_strings(pd.Series(list(col.cat.categories) + [np.nan], dtype=object))
+            columns[i] = pd.Series(labels.to_numpy()[col.cat.codes.to_numpy()], index=df.index, dtype=labels.dtype)
+        else:
+            columns[i] = display_strings(col)
+    out = pd.DataFrame(columns, index=df.index)
+    out.columns = df.columns
+    return out
+
+# 分页预览只格式化可见的行列窗口 (位置切片)：先把窗口里的分类列展开，不必为一页几十个单元格转换整列的全部类别
+def display_window(df, rows, cols):
+    return display_frame(expand_frame(df.iloc[rows, cols]))
+
+# 估算同样的数据按改造前的方式 (普通文本列、日期为 datetime.date 对象、数值为 64 位) 存放时占用的内存，逐列展开测量
+def expanded_nbytes(df):
+    total = int(df.index.memory_usage(deep=True))
+    date_size = 8 + sys.getsizeof(datetime.date(2000, 1, 1))
+    for i in range(len(df.columns)):
+        col = df.iloc[:, i]
+        if df.columns[i] == '来源日期' and pd.api.types.is_integer_dtype(col.dtype): total += len(col) * date_size
+        elif isinstance(col.dtype, pd.CategoricalDtype): total += int(expand_series(col).memory_usage(deep=True, index=False))
+        elif pd.api.types.is_numeric_dtype(col.dtype): total += len(col) * 8
+        else: total += int(col.memory_usage(deep=True, index=False))
+    return total
+
+# ================= 核心统计算法库 =================
+IGNORE_WORDS = ['0', '0.0', 'nan', 'none', '星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日', '体育', '班会', '国学', '美术', '音乐', '大扫除']
+KNOWN_TYPES = ['早自', '正大', '正小', '晚自', '自大', '自小', '辅导', '正课', '早读', '晚修']
+DATE_RE = re.compile(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}')
+WEEK_RE = re.compile(r'^第[一二三四五六七八九十]+周')
+COUNT_RE = re.compile(r'(\d+(?:\.\d+)?)$')
+# 与 COUNT_RE 的 search 语义等价：惰性前缀保证取到最靠左的尾部数字
+COUNT_SPLIT_RE = re.compile(r'^(.*?)(\d+(?:\.\d+)?)$', re.S)
+GRADE_RE = re.compile(r'^([\u4e00-\u9fa5a-zA-Z]+?)(高[一二三]|初[一二三]|小[一二三四五六])(.*)$')
+LESSON_COLS = ['教师姓名', '课程类别', '课时数']
+
+def parse_class_string(val_str):
+    val_str = str(val_str).replace(" ", "") 
+    if not val_str or val_str.lower() in IGNORE_WORDS or DATE_RE.search(val_str) or WEEK_RE.search(val_str):
+        return None
+        
+    count = 1.0
+    m_num = COUNT_RE.search(val_str)
+    if m_num:
+        if m_num.start() == 0: return None
+        count = float(m_num.group(1))
+        val_str = val_str[:m_num.start()] 
+        
+    match = GRADE_RE.match(val_str)
+    if match: return {'教师姓名': match.group(1), '课程类别': match.group(2) + match.group(3), '课时数': count}
+        
+    for kt in KNOWN_TYPES:
+        if val_str.endswith(kt): return {'教师姓名': val_str[:-len(kt)], '课程类别': kt, '课时数': count}
+            
+    if len(val_str) >= 2: return {'教师姓名': val_str, '课程类别': '常规课', '课时数': count}
+    return None
+
+# 批量版 parse_class_string：整列 (Series) 或整块 (DataFrame, 按列展开) 一次解析
+# 返回保留原索引的 教师姓名/课程类别/课时数 三列，无法识别的单元格直接剔除
+def parse_class_series(values):
+    if isinstance(values, pd.DataFrame): values = values.unstack()
+    # 逐格 str() 保证与标量版完全一致 (NaN -> 'nan', 时间戳 -> 'YYYY-MM-DD HH:MM:SS')
+    codes, uniques = pd.factorize(pd.Series([str(v).replace(" ", "") for v in values], dtype=object))
+    # 课表里同一格文本大量重复，只对去重后的文本跑正则，再按编码广播回原位置
+    parsed = _parse_unique_cells(pd.Series(uniques, dtype=object))
+    hit = parsed.index.values
+    lookup = np.full(len(uniques), -1)
+    lookup[hit] = np.arange(len(hit))
+    rows = lookup[codes]
+    keep = rows >= 0
+    out = parsed.iloc[rows[keep]]
+    out.index = values.index[keep]
+    return out
+
+def _parse_unique_cells(s):
+    if s.empty: return pd.DataFrame({c: pd.Series(dtype=object if c != '课时数' else float) for c in LESSON_COLS})
+
+    dead = (s == "") | s.str.lower().isin(IGNORE_WORDS) | s.str.contains(DATE_RE) | s.str.contains(WEEK_RE)
+
+    split = s.str.extract(COUNT_SPLIT_RE)
+    has_num = split[1].notna()
+    dead |= has_num & (split[0] == "")
+    body = s.where(~has_num, split[0])
+    count = split[1].where(has_num, 1.0).astype(float)
+
+    grade = body.str.extract(GRADE_RE)
+    has_grade = grade[0].notna()
+    tail = body.str[-2:]
+    has_kt = ~has_grade & tail.isin(KNOWN_TYPES)
+    keep = ~dead & (has_grade | has_kt | (body.str.len() >= 2))
+
+    teacher = body.copy()
+    category = pd.Series('常规课', index=s.index, dtype=object)
+    teacher[has_kt] = body[has_kt].str[:-2]
+    category[has_kt] = tail[has_kt]
+    teacher[has_grade] = grade[0][has_grade]
+    category[has_grade] = grade[1][has_grade] + grade[2][has_grade]
+    return pd.DataFrame({'教师姓名': teacher, '课程类别': category, '课时数': count})[keep]
+
+# ================= 课时事实表 =================
+FACT_COLS = ['来源班级', '列序号', '来源日期', '原始内容'] + LESSON_COLS
+
+# ================= 日期锚定 =================
+# 课表里每列自上而下，日期单元格 (如 2024-09-02、2024/9/2 或 Excel 日期) 之后、下一个日期之前的单元格都属于这一天
+NO_DATE = np.iinfo(np.int64).min
+
+# 同一个日期文本只解析一次 (整本课表里不同的日期不过几百个)，解析失败记为 None
+@functools.lru_cache(maxsize=8192)
+def parse_date_text(text):
+    try: return date_code(pd.to_datetime(text).date())
+    except Exception: return None
+
+# 与逐格 str(v).strip() 结果相同，但每种取值只转换一次：返回 (每行取值编号, 编号对应的文本)
+def _column_texts(col):
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        # 末尾补一个缺失值，编号 -1 (空单元格) 正好取到它
+        return col.cat.codes.to_numpy(), np.array([str(v).strip() for v in col.cat.categories] + ['nan'], dtype=object)
+    codes, texts = pd.factorize(pd.Series([str(v).strip() for v in col], dtype=object))
+    return codes, texts.to_numpy(dtype=object)
+
+# 每列一遍向量化扫描：正则与日期解析只对列里的不同取值做，再按编号铺回各行，向下携带最近一次成功解析的日期
+# 日期单元格本身不计入；解析失败的日期单元格同样跳过，且不改变当前日期
+# 返回 (列序号, 日期天数编码, 单元格文本, 日期单元格表)，前三项为等长数组；
+# 日期单元格表每个解析成功的日期单元格一行 (行号、列序号均为 0 起始位置，日期为天数编码)，按列、行排序，是整张表的日期行索引
+def anchor_dates(df):
+    cols, days, cells, date_cells = [], [], [], []
+    for col_pos in range(len(df.columns)):
+        codes, texts = _column_texts(df.iloc[:, col_pos])
+        matches = [DATE_RE.search(t) for t in texts]
+        parsed = [None if m is None else parse_date_text(m.group(0)) for m in matches]
+        text_days = np.array([NO_DATE if d is None else d for d in parsed], dtype=np.int64)
+        is_anchor = np.array([m is not None for m in matches], dtype=bool)[codes]
+        row_days = text_days[codes]
+        valid = row_days != NO_DATE
+        if not valid.any(): continue
+        last = np.maximum.accumulate(np.where(valid, np.arange(len(codes)), -1))
+        rows = np.nonzero(~is_anchor & (last >= 0))[0]
+        cols.append(np.full(len(rows), col_pos, dtype=np.int64))
+        days.append(row_days[last[rows]])
+        cells.append(texts[codes[rows]])
+        date_rows = np.nonzero(valid)[0]
+        date_cells.append(pd.DataFrame({'行号': date_rows.astype(np.int32), '列序号': np.full(len(date_rows), col_pos, dtype=np.int16),
+                                        '日期': row_days[date_rows].astype(np.int32)}))
+    if not cols:
+        empty_cells = pd.DataFrame({'行号': np.zeros(0, dtype=np.int32), '列序号': np.zeros(0, dtype=np.int16), '日期': np.zeros(0, dtype=np.int32)})
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=object), empty_cells
+    return np.concatenate(cols), np.concatenate(days).astype(np.int32), np.concatenate(cells), pd.concat(date_cells, ignore_index=True)
+
+# 列窗口 (0 起始闭区间) 内出现过的最早、最晚日期 (datetime.date)，没有日期时返回 None
+def span_dates(date_cells, col_lo, col_hi):
+    picked = date_cells['日期'][date_cells['列序号'].between(col_lo, col_hi)]
+    if picked.empty: return None
+    return decode_dates([picked.min(), picked.max()]).tolist()
+
+# 把日期单元格按所在行归并：以行号为索引，给出该行最早、最晚日期的天数编码，以及该行最靠左的日期单元格所在列，按行号排序
+def group_date_rows(date_cells):
+    return date_cells.groupby('行号').agg(min=('日期', 'min'), max=('日期', 'max'), 列序号=('列序号', 'min'))
+
+# 列窗口内、日期落在 [f_start, f_end] 的日期单元格所在行，只统计窗口内的单元格
+def date_rows_in_range(date_cells, col_lo, col_hi, f_start, f_end):
+    mask = date_cells['列序号'].between(col_lo, col_hi) & date_cells['日期'].between(date_code(f_start), date_code(f_end))
+    return group_date_rows(date_cells[mask])
+
+# ================= 课时事实表 (续) =================
+# 日期锚定之后，把每个带日期的单元格整批解析成「一节课一行」的长表
+# 之后无论改日期还是改列窗口，都只是对这张表做布尔筛选 + 分组，不再重新扫描/解析
+# stats 传入字典时顺带记下 单元格数 / 课时记录数 / 锚定与解析耗时，供诊断面板使用；
+# 已经做过日期锚定的 (anchor_dates 的结果) 可以直接传进来，不再重扫
+def build_lesson_facts(sheet_name, df, stats=None, anchors=None):
+    t0 = time.perf_counter()
+    cols, days, cells, _ = anchors if anchors is not None else anchor_dates(df)
+    t1 = time.perf_counter()
+    parsed = parse_class_series(pd.Series(cells, dtype=object))
+    rows = parsed.index.values
+    facts = pd.DataFrame({
+        '来源班级': pd.Categorical.from_codes(np.zeros(len(rows), dtype=np.int8), categories=[sheet_name]),
+        '列序号': cols[rows].astype(np.int16),
+        '来源日期': days[rows],
+        '原始内容': pd.Categorical(cells[rows]),
+        '教师姓名': pd.Categorical(parsed['教师姓名'].values),
+        '课程类别': pd.Categorical(parsed['课程类别'].values),
+        '课时数': parsed['课时数'].values.astype(np.float64),
+    })
+    if stats is not None: stats.update(cells=len(cells), records=len(facts), anchor_ms=round((t1 - t0) * 1000, 2), parse_ms=elapsed_ms(t1))
+    return facts[FACT_COLS]
+
+# 列窗口为 0 起始的闭区间 [col_lo, col_hi]；事实表里的日期是天数编码，比较前先把查询日期转过去
+def select_lessons(facts, col_lo, col_hi, f_start, f_end):
+    mask = facts['列序号'].between(col_lo, col_hi) & (facts['来源日期'] >= date_code(f_start)) & (facts['来源日期'] <= date_code(f_end))
+    return facts[mask]
+
+# ================= 前缀和查询索引 =================
+# 以 (班级, 教师, 类别) 组合 × 日期 为二维稠密数组，沿日期轴做累计和；
+# 任意 [f_start, f_end] 的透视表 = 两个日期切片相减后按 教师×类别 归并，不再重新聚合明细
+class LessonIndex:
+    def __init__(self, facts, col_lo, col_hi):
+        facts = facts[facts['列序号'].between(col_lo, col_hi)]
+        self.days = np.unique(facts['来源日期'].values.astype('datetime64[D]'))
+        day_pos = np.searchsorted(self.days, facts['来源日期'].values.astype('datetime64[D]'))
+
+        s_codes, self.sheets = pd.factorize(expand_series(facts['来源班级']), sort=True)
+        t_codes, self.teachers = pd.factorize(expand_series(facts['教师姓名']), sort=True)
+        c_codes, self.categories = pd.factorize(expand_series(facts['课程类别']), sort=True)
+        nt, nc = len(self.teachers), len(self.categories)
+        combo_codes, combos = pd.factorize((s_codes * nt + t_codes) * nc + c_codes)
+        self.combo_sheet, self.combo_cell = combos // (nt * nc), combos % (nt * nc)
+
+        # 第 0 列留空，保证 cum[:, hi] - cum[:, lo] 即为 [lo, hi) 日期段之和
+        hours = np.zeros((len(combos), len(self.days) + 1))
+        lessons = np.zeros((len(combos), len(self.days) + 1))
+        np.add.at(hours, (combo_codes, day_pos + 1), facts['课时数'].values.astype(float))
+        np.add.at(lessons, (combo_codes, day_pos + 1), 1)
+        self.cum_hours, self.cum_lessons = hours.cumsum(axis=1), lessons.cumsum(axis=1)
+        self.last_query_ms = 0.0
+
+    def pivot(self, f_start, f_end, sheets=None):
+        t0 = time.perf_counter()
+        lo = np.searchsorted(self.days, np.datetime64(f_start, 'D'), side='left')
+        hi = np.searchsorted(self.days, np.datetime64(f_end, 'D'), side='right')
+        hours = self.cum_hours[:, hi] - self.cum_hours[:, lo]
+        lessons = self.cum_lessons[:, hi] - self.cum_lessons[:, lo]
+        if sheets is not None:
+            picked = np.isin(self.combo_sheet, self.sheets.get_indexer(list(sheets)))
+            hours, lessons = np.where(picked, hours, 0.0), np.where(picked, lessons, 0.0)
+
+        nt, nc = len(self.teachers), len(self.categories)
+        # 两个累计和相减会留下 1e-12 量级的浮点尾差 (如 0.30000000000007)，课时数最多几位小数，舍到 9 位即可抹掉
+        grid = np.round(np.bincount(self.combo_cell, weights=hours, minlength=nt * nc), 9).reshape(nt, nc)
+        # 课时数为 0 的课也要占住行列，与 pivot_table 保持一致，所以按「节数」而不是「课时」判断是否出现
+        seen = np.bincount(self.combo_cell, weights=lessons, minlength=nt * nc).reshape(nt, nc) > 0
+        rows, cols = seen.any(axis=1), seen.any(axis=0)
+        pivot_df = pd.DataFrame(grid[rows][:, cols],
+                                index=pd.Index(self.teachers[rows], name='教师姓名'),
+                                columns=pd.Index(self.categories[cols], name='课程类别'))
+        self.last_query_ms = (time.perf_counter() - t0) * 1000
+        return pivot_df
+
+# ================= 报表汇总 (网页与命令行共用) =================
+REPORT_EXCLUDE_KEYWORDS = ['总表', '分表', '汇总']
+DETAIL_COLS = LESSON_COLS + ['来源班级', '来源日期']
+
+def valid_class_sheets(sheet_names):
+    return [s for s in sheet_names if not any(kw in s for kw in REPORT_EXCLUDE_KEYWORDS)]
+
+# 从各班事实表中取出列窗口 (0 起始闭区间) 与日期段内的课，拼成明细表；来源日期转成字符串便于展示和导出
+def collect_report_records(facts_by_sheet, targets, col_lo, col_hi, f_start, f_end):
+    picked = [select_lessons(facts_by_sheet[name], col_lo, col_hi, f_start, f_end) for name in targets if name in facts_by_sheet]
+    picked = [p for p in picked if not p.empty]
+    if not picked: return pd.DataFrame(columns=DETAIL_COLS)
+    stat_df = pd.concat(picked, ignore_index=True)
+    return pd.DataFrame({'教师姓名': expand_series(stat_df['教师姓名']), '课程类别': expand_series(stat_df['课程类别']),
+                         '课时数': stat_df['课时数'].astype(float), '来源班级': expand_series(stat_df['来源班级']),
+                         '来源日期': decode_dates(stat_df['来源日期']).astype(str)}, columns=DETAIL_COLS)
+
+def pivot_lessons(stat_df):
+    pivot_df = pd.pivot_table(stat_df, values='课时数', index='教师姓名', columns='课程类别', aggfunc='sum', fill_value=0)
+    pivot_df['总计'] = pivot_df.sum(axis=1)
+    return pivot_df
+
+# ================= 并行多表读取 =================
+# 装了 python-calamine (Rust 实现) 就用它读表，否则退回 openpyxl；两者都只在子进程里以只读方式打开工作簿
+EXCEL_READ_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+INGEST_WORKERS = int(os.environ.get('KESHI_INGEST_WORKERS', min(8, os.cpu_count() or 1)))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# 进程池整个服务进程只建一次 (多个会话线程可能同时上传，建池时加锁)。Streamlit 服务进程里有多个线程 (tornado、后台报表线程池)，直接 fork 可能把别的线程持有的锁带进子进程而死锁，
+# 所以 POSIX 下用 forkserver：由一个单线程的服务进程预先导入 engine，再从它 fork 出工作进程；没有 forkserver 的平台 (Windows) 用 spawn
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload(['engine'])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _process_pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=context)
+        return _process_pool
+
+# 丢弃已损坏的进程池并关掉它的工作进程；别的会话可能已经换上了新池，只有它仍是当前共享池时才置空
+def discard_process_pool(pool):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool: _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+    log_event('process_pool_discarded')
+
+# 单张表的完整处理：读取 + 清洗 + 日期锚定扫描，在子进程里执行，返回 (清洗后的表, 事实表, 日期单元格表, 逐表开销)
+# 日期单元格表随事实表一起带回，日期选择器和预览跳转直接用它，不必在界面进程里再锚定一遍
+def load_sheet(path, sheet_name, engine=EXCEL_READ_ENGINE):
+    t0 = time.perf_counter()
+    raw = pd.read_excel(path, sheet_name=sheet_name, engine=engine)
+    t1 = time.perf_counter()
+    df = compact_frame(clean_excel_data(raw))
+    t2 = time.perf_counter()
+    stats = {'rows': len(df), 'cols': len(df.columns), 'read_ms': round((t1 - t0) * 1000, 2), 'clean_ms': round((t2 - t1) * 1000, 2)}
+    anchors = anchor_dates(df)
+    anchor_ms = elapsed_ms(t2)
+    facts = build_lesson_facts(sheet_name, df, stats, anchors=anchors)
+    stats.update(anchor_ms=anchor_ms, total_ms=elapsed_ms(t0))
+    return df, facts, anchors[3], stats
+
+# 每张表作为独立任务丢进进程池，按完成顺序逐个产出 (表名, (清洗后的表, 事实表, 日期单元格表, 逐表开销))
+# 生成器被提前关闭 (界面上点了取消、脚本被 Streamlit 中断) 时，尚未开始的任务一并撤销
+def iter_sheet_tasks(path, sheet_names, parallel=True):
+    done, futures = set(), {}
+    try:
+        if parallel and INGEST_WORKERS > 1 and len(sheet_names) > 1:
+            pool = None
+            try:
+                pool = get_process_pool()
+                futures = {pool.submit(load_sheet, path, name): name for name in sheet_names}
+            except (OSError, BrokenExecutor):
+                # 建不起进程池或提交不了任务 (无法启动子进程、池已损坏)：丢弃它，下面串行补齐
+                if pool is not None: discard_process_pool(pool)
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    done.add(futures[future])
+                    yield futures[future], result
+            except BrokenExecutor:
+                # 子进程被系统杀掉等导致进程池损坏，剩下的表串行补齐；表本身读不了的错误 (含 OSError) 由 result() 原样抛出
+                discard_process_pool(pool)
+
+        for name in sheet_names:
+            if name in done: continue
+            done.add(name)
+            yield name, load_sheet(path, name)
+    finally:
+        # 提前关闭时撤销本次还没开始的任务。已经在子进程里跑的表没法中途打断：进程池由所有会话共用，不能为一次取消把它整个杀掉，
+        # 这些表会读完当前这一张再丢弃结果 (最多 INGEST_WORKERS 张)，之后工作进程即空出来
+        pending = [future for future in futures if not future.done()]
+        cancelled = sum(future.cancel() for future in pending)
+        if pending: log_event('sheet_tasks_cancelled', cancelled=cancelled, running=len(pending) - cancelled)
+
+def write_temp_workbook(file_bytes):
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    with os.fdopen(fd, 'wb') as f: f.write(file_bytes)
+    return path
+
+# 读取整本工作簿，按工作簿原顺序返回 ({表名: 清洗后的表}, {表名: 事实表}, {表名: 日期单元格表})
+# progress(已完成数, 总数, 表名) 在每张表完成时回调，供界面显示进度；parallel=False 时在当前进程内逐表处理
+# recorder (StageRecorder) 传入时记下每张表的读取/清洗/锚定/解析开销
+def read_workbook(file_bytes, progress=None, parallel=True, recorder=None):
+    path = write_temp_workbook(file_bytes)
+    try:
+        with pd.ExcelFile(path, engine=EXCEL_READ_ENGINE) as book: sheet_names = book.sheet_names
+        results = {}
+        for name, result in iter_sheet_tasks(path, sheet_names, parallel=parallel):
+            results[name] = result
+            if recorder: recorder.add_sheet(name, result[3])
+            if progress: progress(len(results), len(sheet_names), name)
+        return tuple({name: results[name][i] for name in sheet_names} for i in range(3))
+    finally:
+        os.remove(path)
+
+# ================= 按需加载的工作簿 =================
+# 上传时只读表目录；某张表第一次被访问 (点导航、被纳入全局统计) 时才读取并清洗，
+# 已加载的表放在容量有限的 LRU 里，超出就丢掉最久没用的。对外表现得像 {表名: DataFrame} 字典
+LAZY_MAX_SHEETS = int(os.environ.get('KESHI_LAZY_MAX_SHEETS', 12))
+
+class LazyWorkbook:
+    def __init__(self, file_bytes, max_loaded=LAZY_MAX_SHEETS):
+        self.path = write_temp_workbook(file_bytes)
+        weakref.finalize(self, os.remove, self.path)
+        self.max_loaded = max_loaded
+        with pd.ExcelFile(self.path, engine=EXCEL_READ_ENGINE) as book: self.sheet_names = book.sheet_names
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def keys(self): return list(self.sheet_names)
+    def __iter__(self): return iter(self.sheet_names)
+    def __len__(self): return len(self.sheet_names)
+    def __contains__(self, name): return name in self.sheet_names
+
+    def __getitem__(self, name):
+        if name not in self.sheet_names: raise KeyError(name)
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                return self.loaded[name]
+        df = compact_frame(clean_excel_data(pd.read_excel(self.path, sheet_name=name, engine=EXCEL_READ_ENGINE)))
+        self._remember(name, df)
+        return df
+
+    def _remember(self, name, df):
+        with self.lock:
+            self.loaded[name] = df
+            self.loaded.move_to_end(name)
+            while len(self.loaded) > self.max_loaded: self.loaded.popitem(last=False)
+
+    # 多张表一起要时走进程池并行读取 + 扫描，按完成顺序产出 (表名, 事实表, 日期单元格表)
+    def iter_load(self, names, recorder=None):
+        for name, (df, facts, date_cells, stats) in iter_sheet_tasks(self.path, names):
+            self._remember(name, df)
+            if recorder: recorder.add_sheet(name, stats)
+            yield name, facts, date_cells
+
+# ================= 落盘列存缓存 (Parquet) =================
+# 服务器重启后不必再走 openpyxl：清洗后的表、事实表和日期单元格表按 (文件哈希, 解析规则版本) 落盘，
+# 下次直接内存映射读取 Parquet。解析规则一改，版本号随之变化，旧缓存自然失效并被清理
+DISK_CACHE_DIR = os.environ.get('KESHI_DISK_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.keshi_cache'))
+DISK_CACHE_MAX_MB = float(os.environ.get('KESHI_DISK_CACHE_MB', 2048))
+DISK_CACHE_FORMAT = 4
+# 落盘列存缓存依赖 pyarrow；缺失时自动退化为只用内存缓存
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+def compute_parser_version():
+    parts = [str(DISK_CACHE_FORMAT), EXCEL_READ_ENGINE, repr(IGNORE_WORDS), repr(KNOWN_TYPES)]
+    for fn in (clean_excel_data, parse_class_string, parse_class_series, _parse_unique_cells, parse_date_text, _column_texts, anchor_dates, build_lesson_facts):
+        try: parts.append(inspect.getsource(fn))
+        except (OSError, TypeError): parts.append(fn.__name__)
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()[:12]
+
+PARSER_VERSION = compute_parser_version()
+
+def _encode_label(label):
+    if isinstance(label, str): return label
+    if pd.isna(label): return None
+    if isinstance(label, (np.integer, np.floating)): return label.item()
+    if isinstance(label, (int, float)): return label
+    return str(label)
+
+# Parquet 要求列名唯一且为字符串、同列类型一致：列名改为位置编号另存，混合类型的 object 列统一转为字符串
+# (下游只会对单元格取 str() 或 to_numeric，转换前后结果相同)
+# 分类列同理：类别里混有非字符串时把类别统一转成字符串，仍以分类列存盘
+def _to_columnar(df):
+    out = pd.DataFrame({f"c{i}": df.iloc[:, i] for i in range(len(df.columns))}, index=df.index)
+    for c in out.columns:
+        if isinstance(out[c].dtype, pd.CategoricalDtype):
+            if not all(isinstance(v, str) for v in out[c].cat.categories):
+                out[c] = out[c].astype(object).map(lambda v: None if pd.isna(v) else str(v)).astype('category')
+        elif out[c].dtype == object and not out[c].map(lambda v: isinstance(v, str) or v is None).all():
+            out[c] = out[c].map(lambda v: None if pd.isna(v) else str(v)).astype(object)
+    out.index = out.index.rename('__row__')  # 索引对象与原表共用，不能就地改名
+    return out, [_encode_label(c) for c in df.columns]
+
+def _from_columnar(table, labels):
+    table.columns = [np.nan if c is None else c for c in labels]
+    table.index.name = None
+    return table
+
+def disk_cache_load(file_hash):
+    if not HAS_PYARROW: return None
+    entry_dir = os.path.join(DISK_CACHE_DIR, f"{file_hash}_{PARSER_VERSION}")
+    manifest_path = os.path.join(entry_dir, 'manifest.json')
+    if not os.path.exists(manifest_path): return None
+    try:
+        with open(manifest_path, encoding='utf-8') as f: manifest = json.load(f)
+        clean_sheets, lesson_facts, date_cells = {}, {}, {}
+        for i, (name, labels) in enumerate(zip(manifest['sheets'], manifest['labels'])):
+            table = pd.read_parquet(os.path.join(entry_dir, f"sheet_{i}.parquet"), memory_map=True)
+            clean_sheets[name] = _from_columnar(table, labels)
+            lesson_facts[name] = pd.read_parquet(os.path.join(entry_dir, f"facts_{i}.parquet"), memory_map=True)
+            date_cells[name] = pd.read_parquet(os.path.join(entry_dir, f"dates_{i}.parquet"), memory_map=True)
+        os.utime(manifest_path)  # 记录最近使用时间，供 LRU 淘汰
+        return clean_sheets, lesson_facts, date_cells
+    except Exception:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        return None
+
+def disk_cache_store(file_hash, clean_sheets, lesson_facts, date_cells):
+    if not HAS_PYARROW: return
+    entry_dir = os.path.join(DISK_CACHE_DIR, f"{file_hash}_{PARSER_VERSION}")
+    tmp_dir = None
+    try:
+        os.makedirs(DISK_CACHE_DIR, exist_ok=True)
+        # 先写临时目录再整体改名，进程中途被杀也不会留下半份缓存
+        tmp_dir = tempfile.mkdtemp(dir=DISK_CACHE_DIR, prefix='.tmp_')
+        manifest = {'sheets': list(clean_sheets), 'labels': [], 'parser_version': PARSER_VERSION}
+        for i, (name, df) in enumerate(clean_sheets.items()):
+            table, labels = _to_columnar(df)
+            table.to_parquet(os.path.join(tmp_dir, f"sheet_{i}.parquet"))
+            lesson_facts[name].to_parquet(os.path.join(tmp_dir, f"facts_{i}.parquet"), index=False)
+            date_cells[name].to_parquet(os.path.join(tmp_dir, f"dates_{i}.parquet"), index=False)
+            manifest['labels'].append(labels)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False)
+        if os.path.exists(entry_dir): shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+    except Exception:
+        if tmp_dir: shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+    disk_cache_evict()
+
+# 先清掉旧解析版本的缓存，再按最近使用时间从旧到新删除，直到总大小回到上限以内
+def disk_cache_evict():
+    entries = []
+    for name in os.listdir(DISK_CACHE_DIR):
+        path = os.path.join(DISK_CACHE_DIR, name)
+        if not os.path.isdir(path) or name.startswith('.tmp_'): continue
+        if not name.endswith(f"_{PARSER_VERSION}"):
+            shutil.rmtree(path, ignore_errors=True); continue
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        manifest_path = os.path.join(path, 'manifest.json')
+        used = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else 0
+        entries.append((used, size, path))
+    total = sum(size for _, size, _ in entries)
+    for used, size, path in sorted(entries):
+        if total <= DISK_CACHE_MAX_MB * 1024 * 1024: break
+        shutil.rmtree(path, ignore_errors=True); total -= size
+
+# ================= 学期课时库 (SQLite) =================
+# 每次上传的课时记录按文件哈希存入本地库，跨周汇总时直接查库，不必把整学期的文件重新上传解析
+# 班级/教师/类别名统一编号存进 names 表，日期存为序数；整学年的聚合只在整数列上分组，保持在一秒以内
+LESSON_DB_PATH = os.environ.get('KESHI_LESSON_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.keshi_data', 'lessons.sqlite3'))
+LESSON_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    file_hash TEXT PRIMARY KEY, file_name TEXT, parser_version TEXT,
+    date_min TEXT, date_max TEXT, n_rows INTEGER, ingested_at REAL);
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS lessons (
+    file_hash TEXT NOT NULL, sheet_id INTEGER NOT NULL, col INTEGER NOT NULL, day INTEGER NOT NULL,
+    teacher_id INTEGER NOT NULL, category_id INTEGER NOT NULL, hours REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_lessons_day ON lessons (day, sheet_id, col, teacher_id, category_id, hours);
+CREATE INDEX IF NOT EXISTS idx_lessons_teacher ON lessons (teacher_id, day);
+CREATE INDEX IF NOT EXISTS idx_lessons_sheet ON lessons (sheet_id, day);
+CREATE INDEX IF NOT EXISTS idx_lessons_category ON lessons (category_id, day);
+CREATE INDEX IF NOT EXISTS idx_lessons_file ON lessons (file_hash);
+"""
+
+# 每次操作单独开连接 (Streamlit 各会话跑在不同线程里，sqlite3 连接不能跨线程共用)；WAL 模式下读写互不阻塞
+class LessonStore:
+    def __init__(self, path=None):
+        self.path = path or LESSON_DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(LESSON_DB_SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return contextlib.closing(conn)
+
+    def _name_ids(self, conn, names, create=False):
+        names = list(dict.fromkeys(names))
+        if create: conn.executemany("INSERT OR IGNORE INTO names (name) VALUES (?)", ((n,) for n in names))
+        found = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            found.update({n: k for k, n in conn.execute(f"SELECT id, name FROM names WHERE name IN ({','.join('?' * len(chunk))})", chunk)})
+        return found
+
+    # 只追加：默认只存入库里还没有的周，某班某周已由别的文件存过时，新文件里这一周的记录不写入 (计入 conflicts)，同一文件再存直接跳过；
+    # replace=True 表示作为更正存入：各班只替换新文件实际含有课时的那几周 (周一起算的自然周)，其余周一概不动
+    def ingest(self, file_hash, file_name, lesson_facts, replace=False):
+        facts = [f for f in lesson_facts.values() if not f.empty]
+        facts = pd.concat(facts, ignore_index=True) if facts else pd.DataFrame(columns=FACT_COLS)
+        days = facts['来源日期'].astype('int64') + EPOCH_ORDINAL
+        # 序数 1 (公元 1 年 1 月 1 日) 是星期一，(序数 - 1) // 7 即周一起算的周编号
+        weeks = (days - 1) // 7
+        sheet_col, teacher_col, category_col = (expand_series(facts[c]) for c in ('来源班级', '教师姓名', '课程类别'))
+        sheet_weeks = pd.DataFrame({'sheet': sheet_col.values, 'week': weeks.values}).drop_duplicates()
+        with self.connect() as conn:
+            known = conn.execute("SELECT parser_version FROM workbooks WHERE file_hash = ?", (file_hash,)).fetchone()
+            if not replace and known is not None and known[0] == PARSER_VERSION: return {'status': 'skipped', 'rows': 0, 'replaced': 0, 'conflicts': 0}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = self._name_ids(conn, pd.concat([sheet_col, teacher_col, category_col]).unique().tolist(), create=True)
+                sheet_ids = sheet_col.map(ids)
+                replaced = conn.execute("DELETE FROM lessons WHERE file_hash = ?", (file_hash,)).rowcount
+                week_ranges = [(ids[sheet], int(week) * 7 + 1, int(week) * 7 + 7) for sheet, week in sheet_weeks.itertuples(index=False)]
+                keep = pd.Series(True, index=facts.index)
+                conflicts = 0
+                for sheet_id, lo, hi in week_ranges:
+                    if replace:
+                        replaced += conn.execute("DELETE FROM lessons WHERE sheet_id = ? AND day BETWEEN ? AND ?", (sheet_id, lo, hi)).rowcount
+                    elif conn.execute("SELECT 1 FROM lessons WHERE sheet_id = ? AND day BETWEEN ? AND ? LIMIT 1", (sheet_id, lo, hi)).fetchone():
+                        keep &= ~((sheet_ids == sheet_id) & days.between(lo, hi)); conflicts += 1
+                rows = zip(sheet_ids[keep].tolist(), facts['列序号'][keep].astype(int).tolist(), days[keep].tolist(),
+                           teacher_col[keep].map(ids).tolist(), category_col[keep].map(ids).tolist(), facts['课时数'][keep].astype(float).tolist())
+                conn.executemany("INSERT INTO lessons VALUES (?, ?, ?, ?, ?, ?, ?)", ((file_hash,) + r for r in rows))
+                stored = days[keep]
+                span = (str(datetime.date.fromordinal(int(stored.min()))), str(datetime.date.fromordinal(int(stored.max())))) if len(stored) else (None, None)
+                conn.execute("INSERT OR REPLACE INTO workbooks VALUES (?, ?, ?, ?, ?, ?, ?)", (file_hash, file_name, PARSER_VERSION) + span + (len(stored), time.time()))
+                # 记录被新文件全部替换掉的旧文件不再列出，之后重新上传它会被当作新文件再次存入
+                conn.execute("DELETE FROM workbooks WHERE NOT EXISTS (SELECT 1 FROM lessons WHERE lessons.file_hash = workbooks.file_hash) AND file_hash != ?", (file_hash,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK"); raise
+        return {'status': 'ingested', 'rows': int(keep.sum()), 'replaced': replaced, 'conflicts': conflicts}
+
+    def _where(self, conn, sheets, f_start, f_end, col_lo, col_hi):
+        clauses, params = ["day BETWEEN ? AND ?"], [f_start.toordinal(), f_end.toordinal()]
+        if sheets is not None:
+            sheet_ids = list(self._name_ids(conn, sheets).values())
+            clauses.append(f"sheet_id IN ({','.join('?' * len(sheet_ids)) or 'NULL'})"); params += sheet_ids
+        if col_lo is not None:
+            clauses.append("col BETWEEN ? AND ?"); params += [col_lo, col_hi]
+        return " AND ".join(clauses), params
+
+    def _names(self, conn, ids):
+        ids = [int(i) for i in pd.unique(ids)]
+        found = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            found.update(conn.execute(f"SELECT id, name FROM names WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return found
+
+    # 返回与 collect_report_records 相同结构的明细表；列窗口为 0 起始闭区间，不传则不限列；limit 只取前若干行 (界面预览用)
+    def query_records(self, sheets, f_start, f_end, col_lo=None, col_hi=None, limit=None):
+        with self.connect() as conn:
+            where, params = self._where(conn, sheets, f_start, f_end, col_lo, col_hi)
+            sql = f"SELECT teacher_id, category_id, hours, sheet_id, day FROM lessons WHERE {where} ORDER BY day, rowid"
+            if limit is not None: sql += " LIMIT ?"; params.append(int(limit))
+            raw = pd.read_sql_query(sql, conn, params=params)
+            names = self._names(conn, pd.concat([raw['teacher_id'], raw['category_id'], raw['sheet_id']]))
+        days = {d: str(datetime.date.fromordinal(int(d))) for d in raw['day'].unique()}
+        return pd.DataFrame({'教师姓名': raw['teacher_id'].map(names), '课程类别': raw['category_id'].map(names), '课时数': raw['hours'],
+                             '来源班级': raw['sheet_id'].map(names), '来源日期': raw['day'].map(days)}, columns=DETAIL_COLS)
+
+    # 汇总在库里按 教师×类别 聚合好再取回，整学年的区间也只搬运几百行；日期索引带上了查询用到的全部列，聚合时不必回表
+    def query_pivot(self, sheets, f_start, f_end, col_lo=None, col_hi=None):
+        with self.connect() as conn:
+            where, params = self._where(conn, sheets, f_start, f_end, col_lo, col_hi)
+            agg = pd.read_sql_query(f"SELECT teacher_id, category_id, SUM(hours) AS hours FROM lessons WHERE {where} GROUP BY teacher_id, category_id", conn, params=params)
+            names = self._names(conn, pd.concat([agg['teacher_id'], agg['category_id']]))
+        agg_df = pd.DataFrame({'教师姓名': agg['teacher_id'].map(names), '课程类别': agg['category_id'].map(names), '课时数': agg['hours']})
+        return pivot_lessons(agg_df)
+
+    def summary(self):
+        with self.connect() as conn:
+            n_files, date_min, date_max, updated_at = conn.execute("SELECT COUNT(*), MIN(date_min), MAX(date_max), MAX(ingested_at) FROM workbooks").fetchone()
+            n_rows = conn.execute("SELECT COUNT(*) FROM lessons").fetchone()[0]
+        # updated_at 为最近一次存入的时间，库内容变了它就变，可用作查询结果缓存的版本号
+        return {'files': n_files, 'date_min': date_min, 'date_max': date_max, 'rows': n_rows, 'updated_at': updated_at}
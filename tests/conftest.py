@@ -0,0 +1,21 @@
+# 测试直接导入仓库根目录下的 engine.py (不依赖 streamlit)，合成课表借用 benchmarks/synth_workbook.py
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from engine import clean_excel_data, build_lesson_facts
+from synth_workbook import make_book
+
+# 小号合成工作簿：6 个班级 (含总表) 各 3 周，清洗后的表与事实表整个测试会话共用
+@pytest.fixture(scope='session')
+def synthetic_sheets():
+    return {name: clean_excel_data(df) for name, df in make_book(6, seed=7, weeks=3, periods=6).items()}
+
+@pytest.fixture(scope='session')
+def synthetic_facts(synthetic_sheets):
+    return {name: build_lesson_facts(name, df) for name, df in synthetic_sheets.items()}
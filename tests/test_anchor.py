@@ -0,0 +1,104 @@
+# 向量化日期锚定必须与原先逐格扫描 (正则 + pd.to_datetime) 的结果一致：锚定出的单元格、事实表、各列日期范围
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine import (DATE_RE, FACT_COLS, anchor_dates, build_lesson_facts, compact_frame, date_code, date_rows_in_range, decode_dates, display_frame,
+                    expand_frame, group_date_rows, parse_class_series, span_dates)
+
+# 原先的逐格扫描，原样保留作对照
+def old_anchor_date_cells(df):
+    cols, dates, cells = [], [], []
+    for col_pos in range(len(df.columns)):
+        current_date = None
+        for val in df.iloc[:, col_pos]:
+            val_str = str(val).strip()
+            m = DATE_RE.search(val_str)
+            if m:
+                try: current_date = pd.to_datetime(m.group(0)).date()
+                except: pass
+                continue
+            if current_date:
+                cols.append(col_pos); dates.append(current_date); cells.append(val_str)
+    return cols, dates, cells
+
+def old_build_lesson_facts(sheet_name, df):
+    cols, dates, cells = old_anchor_date_cells(df)
+    parsed = parse_class_series(pd.Series(cells, dtype=object))
+    rows = parsed.index.values
+    return pd.DataFrame({
+        '来源班级': pd.Categorical([sheet_name] * len(rows)),
+        '列序号': np.asarray(cols, dtype=np.int16)[rows],
+        '来源日期': np.asarray([date_code(d) for d in dates], dtype=np.int32)[rows] if dates else np.zeros(0, dtype=np.int32),
+        '原始内容': pd.Categorical(pd.Series(cells, dtype=object).iloc[rows].values),
+        '教师姓名': pd.Categorical(parsed['教师姓名'].values),
+        '课程类别': pd.Categorical(parsed['课程类别'].values),
+        '课时数': parsed['课时数'].values.astype(np.float64),
+    })[FACT_COLS]
+
+# 原先单班页面在渲染后的表格上逐格找日期，取列窗口内的最早、最晚日期
+def old_span(df, col_lo, col_hi):
+    display_df, found = display_frame(expand_frame(df)), set()
+    for col in range(col_lo, col_hi + 1):
+        for val in display_df.iloc[:, col]:
+            m = DATE_RE.search(str(val).strip())
+            if m:
+                try: found.add(pd.to_datetime(m.group(0)).date())
+                except: pass
+    return [min(found), max(found)] if found else None
+
+# 边界情况：非法日期 (不改变当前日期)、日期之前的单元格、数字、datetime 单元格、空值、重复日期、整列无日期
+EDGE = pd.DataFrame({
+    '节次': ['第一周', '1', '2', '2024/9/2', '3', 4, None],
+    '周一': ['张伟高一语文', '2024-09-02 星期一', '李娜英语2', '2024/13/45', '王芳数学', np.nan, '2024-9-2'],
+    '周二': [datetime.datetime(2024, 9, 3), '赵强物理', 3.5, pd.Timestamp('2024-09-10'), '刘洋化学', '', '陈静'],
+    '备注': ['无', '', None, '张伟', 7, 'x', '周会'],
+}, dtype=object)
+
+def frames(synthetic_sheets):
+    sheets = dict(synthetic_sheets, 边界=EDGE)
+    for name, df in list(sheets.items()): sheets[name + '·compact'] = compact_frame(df)
+    return sheets
+
+def test_anchor_cells_match_old_scan(synthetic_sheets):
+    for name, df in frames(synthetic_sheets).items():
+        cols, dates, cells = old_anchor_date_cells(df)
+        new_cols, new_days, new_cells, date_cells = anchor_dates(df)
+        assert new_cols.tolist() == cols, name
+        assert decode_dates(new_days).tolist() == dates, name
+        assert new_cells.tolist() == cells, name
+
+def test_invalid_date_keeps_current_date():
+    cols, days, cells, date_cells = anchor_dates(EDGE)
+    monday = decode_dates(days[cols == 1]).tolist()
+    # '2024/13/45' 解析失败：自身不计入，之后的单元格仍记在 9 月 2 日下
+    assert '2024/13/45' not in cells.tolist() and set(monday) == {datetime.date(2024, 9, 2)}
+    assert date_cells[date_cells['列序号'] == 1]['行号'].tolist() == [1, 6]
+
+def test_lesson_facts_match_old_scan(synthetic_sheets):
+    for name, df in frames(synthetic_sheets).items():
+        want = old_build_lesson_facts(name, df)
+        got = build_lesson_facts(name, df)
+        pd.testing.assert_frame_equal(got.reset_index(drop=True), want.reset_index(drop=True), check_dtype=False, check_categorical=False)
+        # 传入已有的锚定结果与自己锚定的一样
+        pd.testing.assert_frame_equal(build_lesson_facts(name, df, anchors=anchor_dates(df)), got)
+
+@pytest.mark.parametrize('name', ['高一1班', '边界'])
+def test_span_dates_match_old_scan(synthetic_sheets, name):
+    for label, df in frames(synthetic_sheets).items():
+        if not label.startswith(name): continue
+        date_cells, n = anchor_dates(df)[3], len(df.columns)
+        for col_lo in range(n):
+            for col_hi in range(col_lo, n):
+                assert span_dates(date_cells, col_lo, col_hi) == old_span(df, col_lo, col_hi), (label, col_lo, col_hi)
+
+# 日期行除了行号与日期范围，还要带上日期所在的列 (最靠左的那个)，预览跳转要靠它翻列页
+def test_date_rows_keep_column():
+    date_cells = anchor_dates(EDGE)[3]
+    rows = group_date_rows(date_cells)
+    assert rows.index.tolist() == [0, 1, 3, 6] and rows['列序号'].tolist() == [2, 1, 0, 1]
+    in_window = date_rows_in_range(date_cells, 2, 3, datetime.date(2024, 9, 1), datetime.date(2024, 9, 30))
+    assert in_window.index.tolist() == [0, 3] and in_window['列序号'].tolist() == [2, 2]
+    assert decode_dates(in_window['max']).tolist() == [datetime.date(2024, 9, 3), datetime.date(2024, 9, 10)]
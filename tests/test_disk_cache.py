@@ -0,0 +1,26 @@
+# 读工作簿时带回的日期单元格表与对清洗后的表重新锚定一致，并且能原样经过列存缓存落盘、读回
+import pandas as pd
+import pytest
+
+import engine
+from engine import read_workbook, anchor_dates, disk_cache_load, disk_cache_store
+from synth_workbook import book_bytes
+
+@pytest.fixture(scope='module')
+def loaded():
+    return read_workbook(book_bytes(classes=4, seed=5, weeks=2, periods=6), parallel=False)
+
+def test_date_cells_match_reanchoring(loaded):
+    clean_sheets, lesson_facts, date_cells = loaded
+    assert list(date_cells) == list(clean_sheets)
+    for name, df in clean_sheets.items():
+        pd.testing.assert_frame_equal(date_cells[name], anchor_dates(df)[3])
+
+@pytest.mark.skipif(not engine.HAS_PYARROW, reason='列存缓存依赖 pyarrow')
+def test_disk_cache_round_trip(loaded, tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'DISK_CACHE_DIR', str(tmp_path))
+    disk_cache_store('abc', *loaded)
+    cached = disk_cache_load('abc')
+    assert cached is not None
+    assert list(cached[2]) == list(loaded[2])
+    for name, want in loaded[2].items(): pd.testing.assert_frame_equal(cached[2][name], want)
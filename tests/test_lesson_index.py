@@ -0,0 +1,58 @@
+# 前缀和索引的任意日期段 / 班级子集透视必须与按明细重新 pivot_table 的结果一致
+import datetime
+
+import pandas as pd
+import pytest
+
+from engine import DATE_RE, LessonIndex, build_lesson_facts, collect_report_records, parse_class_string, pivot_lessons, valid_class_sheets
+
+START = datetime.date(2024, 9, 2)
+WINDOWS = [(0, 7), (2, 5), (3, 3)]
+RANGES = [(0, 20), (0, 0), (3, 9), (5, 4), (-3, 40), (30, 40)]
+
+def reference(facts, targets, col_lo, col_hi, f_start, f_end):
+    stat_df = collect_report_records(facts, targets, col_lo, col_hi, f_start, f_end)
+    return None if stat_df.empty else pivot_lessons(stat_df).drop(columns='总计')
+
+@pytest.mark.parametrize('col_lo, col_hi', WINDOWS)
+def test_pivot_matches_pivot_table(synthetic_facts, col_lo, col_hi):
+    targets = valid_class_sheets(synthetic_facts)
+    index = LessonIndex(pd.concat([synthetic_facts[t] for t in targets], ignore_index=True), col_lo, col_hi)
+    subsets = [targets, targets[::2], [t for t in targets if '高二' in t], targets[:1]]
+    for lo, hi in RANGES:
+        f_start, f_end = START + datetime.timedelta(days=lo), START + datetime.timedelta(days=hi)
+        for sheets in subsets:
+            want = reference(synthetic_facts, sheets, col_lo, col_hi, f_start, f_end)
+            got = index.pivot(f_start, f_end, sheets=sheets)
+            if want is None: assert got.empty; continue
+            pd.testing.assert_frame_equal(got, want, check_dtype=False)
+            assert index.last_query_ms >= 0
+
+# 非二进制小数的课时 (0.1、0.3、0.7 ...) 也要与原先逐格解析 + pivot_table 的数字一致，不能带出 0.4000000134 这类存储误差
+FRACTION_SHEET = pd.DataFrame({
+    '周一': ['2024-09-02', '张伟0.3', '张伟0.1', '李娜0.2', '2024-09-03', '张伟0.7', '李娜0.1', '王芳高一语文0.35'],
+    '周二': ['2024-09-04', '张伟0.1', '李娜1.1', '王芳2.3', '2024-09-05', '张伟0.6', '李娜0.05', '王芳高一语文0.15'],
+}, dtype=object)
+
+def old_pivot(df, f_start, f_end):
+    records = []
+    for col in df.columns:
+        current = None
+        for val in df[col]:
+            m = DATE_RE.search(str(val))
+            if m: current = pd.to_datetime(m.group(0)).date(); continue
+            parsed = parse_class_string(val)
+            if current and parsed and f_start <= current <= f_end: records.append(parsed)
+    return pd.pivot_table(pd.DataFrame(records), values='课时数', index='教师姓名', columns='课程类别', aggfunc='sum', fill_value=0)
+
+@pytest.mark.parametrize('lo, hi', [(0, 3), (0, 0), (1, 2), (2, 3)])
+def test_fractional_hours_match_old_pivot_table(lo, hi):
+    facts = {'高一1班': build_lesson_facts('高一1班', FRACTION_SHEET)}
+    f_start, f_end = START + datetime.timedelta(days=lo), START + datetime.timedelta(days=hi)
+    want = old_pivot(FRACTION_SHEET, f_start, f_end)
+    # 明细 → pivot_table 这条路 (全局报表、导出、学期课时库写入都用它) 要逐位相同
+    got = pivot_lessons(collect_report_records(facts, ['高一1班'], 0, 1, f_start, f_end)).drop(columns='总计')
+    pd.testing.assert_frame_equal(got, want, check_exact=True)
+    # 前缀和相减只允许 float64 的舍入尾差；float32 的误差在 1e-8 量级，会在这里被拦下
+    index_got = LessonIndex(facts['高一1班'], 0, 1).pivot(f_start, f_end)
+    pd.testing.assert_frame_equal(index_got, want, check_dtype=False, rtol=1e-12, atol=1e-12)
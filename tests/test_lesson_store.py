@@ -0,0 +1,67 @@
+# 学期课时库：只追加、同一文件幂等、更正只替换新文件实际含有的那几周
+import datetime
+
+import pandas as pd
+import pytest
+
+from engine import LessonStore, FACT_COLS, date_code, collect_report_records, pivot_lessons, valid_class_sheets
+
+MONDAY = datetime.date(2024, 9, 2)
+
+# 每个 (班级, 第几周, 星期几) 一节课；week 从 0 起算
+def make_facts(lessons, teacher='张伟', hours=1.0):
+    rows = [{'来源班级': sheet, '列序号': 3, '来源日期': date_code(MONDAY + datetime.timedelta(weeks=week, days=day)), '原始内容': teacher,
+             '教师姓名': teacher, '课程类别': '常规课', '课时数': hours} for sheet, week, day in lessons]
+    facts = pd.DataFrame(rows, columns=FACT_COLS)
+    return {sheet: facts[facts['来源班级'] == sheet] for sheet in facts['来源班级'].unique()}
+
+def weeks(sheet, ws, days=(0, 1, 2)):
+    return [(sheet, w, d) for w in ws for d in days]
+
+@pytest.fixture
+def store(tmp_path):
+    return LessonStore(str(tmp_path / 'lessons.sqlite3'))
+
+def hours_by_week(store, sheet):
+    df = store.query_records([sheet], MONDAY, MONDAY + datetime.timedelta(weeks=20))
+    week = (pd.to_datetime(df['来源日期']) - pd.Timestamp(MONDAY)).dt.days // 7
+    return df.groupby(week)['课时数'].sum().to_dict()
+
+def test_same_file_is_idempotent(store):
+    a = make_facts(weeks('高一1班', [0, 1]))
+    assert store.ingest('a', 'a.xlsx', a)['rows'] == 6
+    assert store.ingest('a', 'a.xlsx', a)['status'] == 'skipped'
+    assert store.summary()['rows'] == 6
+
+def test_overlapping_file_appends_only_new_weeks(store):
+    store.ingest('a', 'a.xlsx', make_facts(weeks('高一1班', [0, 1]) + weeks('高一2班', [0])))
+    result = store.ingest('b', 'b.xlsx', make_facts(weeks('高一1班', [1, 2]) + weeks('高一2班', [1]), hours=2.0))
+    # 高一1班第 1 周已由 a 存过，b 里的这一周不写入
+    assert (result['rows'], result['replaced'], result['conflicts']) == (6, 0, 1)
+    assert store.summary()['rows'] == 15
+    assert hours_by_week(store, '高一1班') == {0: 3.0, 1: 3.0, 2: 6.0}
+    assert hours_by_week(store, '高一2班') == {0: 3.0, 1: 6.0}
+
+def test_correction_replaces_only_contained_weeks(store):
+    store.ingest('a', 'a.xlsx', make_facts(weeks('高一1班', [0, 1, 2, 3]) + weeks('高一2班', [1])))
+    # 更正文件只含第 1 周，外加一个误填到第 3 周的日期：第 0、2 周和别的班都不能被删
+    correction = make_facts(weeks('高一1班', [1], days=(0, 1)) + [('高一1班', 3, 4)], hours=2.0)
+    result = store.ingest('b', 'b.xlsx', correction, replace=True)
+    assert (result['rows'], result['replaced'], result['conflicts']) == (3, 6, 0)
+    assert store.summary()['rows'] == 15 - 6 + 3
+    assert hours_by_week(store, '高一1班') == {0: 3.0, 1: 4.0, 2: 3.0, 3: 2.0}
+    assert hours_by_week(store, '高一2班') == {1: 3.0}
+    # 再次作为更正存入同一文件，结果不变
+    store.ingest('b', 'b.xlsx', correction, replace=True)
+    assert store.summary()['rows'] == 12 and store.summary()['files'] == 2
+
+# 跨周汇总与单份工作簿用同一个起止列窗口：库里按列窗口查询的结果要与上传工作簿上的同一窗口一致；(0, 99) 即不限列
+@pytest.mark.parametrize('col_lo, col_hi', [(0, 99), (0, 7), (2, 5), (3, 3)])
+def test_column_window_matches_upload_path(store, synthetic_facts, col_lo, col_hi):
+    store.ingest('book', 'book.xlsx', synthetic_facts)
+    targets = valid_class_sheets(synthetic_facts)
+    f_start, f_end = MONDAY, MONDAY + datetime.timedelta(weeks=3)
+    want = collect_report_records(synthetic_facts, targets, col_lo, col_hi, f_start, f_end)
+    got = store.query_records(targets, f_start, f_end, col_lo, col_hi)
+    assert len(got) == len(want) > 0 and got['课时数'].sum() == want['课时数'].sum()
+    pd.testing.assert_frame_equal(store.query_pivot(targets, f_start, f_end, col_lo, col_hi), pivot_lessons(want), check_dtype=False)
@@ -0,0 +1,93 @@
+# 进程池并行读取 + 扫描的结果 (事实表与最终透视) 必须与当前进程内逐表处理完全一致；提前关闭时撤销未开始的任务
+import os
+import time
+import datetime
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import engine
+from engine import read_workbook, iter_sheet_tasks, write_temp_workbook, valid_class_sheets, collect_report_records, pivot_lessons, LessonIndex
+from synth_workbook import book_bytes
+
+@pytest.fixture(scope='module')
+def workbook():
+    return book_bytes(classes=6, seed=3, weeks=3, periods=6, layout='side')
+
+@pytest.fixture
+def workers(monkeypatch):
+    # 单核机器上 INGEST_WORKERS 默认为 1，会直接走串行分支
+    monkeypatch.setattr(engine, 'INGEST_WORKERS', 2)
+
+def report(facts):
+    targets = valid_class_sheets(facts)
+    f_start, f_end = datetime.date(2024, 9, 2), datetime.date(2024, 9, 20)
+    stat_df = collect_report_records(facts, targets, 1, 21, f_start, f_end)
+    index = LessonIndex(pd.concat([facts[t] for t in targets], ignore_index=True), 1, 21)
+    return pivot_lessons(stat_df), index.pivot(f_start, f_end, sheets=targets)
+
+def test_parallel_matches_serial(workbook, workers):
+    sheets_p, facts_p, dates_p = read_workbook(workbook, parallel=True)
+    sheets_s, facts_s, dates_s = read_workbook(workbook, parallel=False)
+    assert list(facts_p) == list(facts_s) == list(dates_s)
+    for name in facts_s:
+        pd.testing.assert_frame_equal(sheets_p[name], sheets_s[name])
+        pd.testing.assert_frame_equal(facts_p[name], facts_s[name])
+        pd.testing.assert_frame_equal(dates_p[name], dates_s[name])
+    for got, want in zip(report(facts_p), report(facts_s)):
+        assert not want.empty
+        pd.testing.assert_frame_equal(got, want)
+
+def test_close_cancels_pending(workbook, workers, monkeypatch):
+    events = []
+    monkeypatch.setattr(engine, 'log_event', lambda event, **fields: events.append((event, fields)))
+    path = write_temp_workbook(workbook)
+    try:
+        with pd.ExcelFile(path) as book: names = book.sheet_names * 4
+        tasks = iter_sheet_tasks(path, names)
+        next(tasks)
+        tasks.close()
+    finally:
+        os.remove(path)
+    assert events and events[0][0] == 'sheet_tasks_cancelled'
+    assert events[0][1]['cancelled'] + events[0][1]['running'] >= 1
+
+# 子进程里读表自己抛出的 OSError (如临时文件不见了) 照常抛给调用方，共享进程池不能因此被丢弃
+def test_worker_oserror_keeps_pool(workers, monkeypatch):
+    monkeypatch.setattr(engine, '_process_pool', None)
+    pool = engine.get_process_pool()
+    try:
+        with pytest.raises(OSError):
+            for _ in iter_sheet_tasks('/nonexistent/keshi.xlsx', ['高一1班', '高一2班']): pass
+        assert engine._process_pool is pool
+    finally:
+        pool.shutdown()
+
+class BrokenPool:
+    def __init__(self): self.shut = False
+    def submit(self, *args): raise BrokenExecutor('worker killed')
+    def shutdown(self, wait=True, cancel_futures=False): self.shut = True
+
+# 进程池损坏时关掉它、从共享位置摘下，剩下的表串行补齐
+def test_broken_pool_is_shut_down_and_replaced(workbook, workers, monkeypatch):
+    broken = BrokenPool()
+    monkeypatch.setattr(engine, '_process_pool', broken)
+    path = write_temp_workbook(workbook)
+    try:
+        with pd.ExcelFile(path) as book: names = book.sheet_names
+        assert [name for name, _ in iter_sheet_tasks(path, names)] == names
+    finally:
+        os.remove(path)
+    assert broken.shut and engine._process_pool is None
+
+# 多个会话线程同时要进程池时只建一个
+def test_concurrent_get_process_pool_creates_one(monkeypatch):
+    created = []
+    class SlowPool:
+        def __init__(self, **kw): time.sleep(0.05); created.append(self)
+    monkeypatch.setattr(engine, '_process_pool', None)
+    monkeypatch.setattr(engine, 'ProcessPoolExecutor', SlowPool)
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        pools = list(threads.map(lambda _: engine.get_process_pool(), range(4)))
+    assert len(created) == 1 and all(p is created[0] for p in pools)
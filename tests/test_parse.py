@@ -0,0 +1,53 @@
+# parse_class_series (批量解析) 与逐格 parse_class_string 的等价性语料
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from engine import parse_class_string, parse_class_series, KNOWN_TYPES, LESSON_COLS
+
+TEACHERS = ['张伟', '欧阳明', 'Amy', '王']
+GRADES = ['高一', '高二', '高三', '初一', '初三', '小二', '小六']
+
+def corpus():
+    cells = [np.nan, None, float('nan'), '', ' ', 'nan', 'NaN', 'None', '0', '0.0', 0, 0.0, 1, 2.5,
+             '星期一', '星期日', '体育', '班会', ' 大扫除 ', '美术',
+             pd.Timestamp(2024, 9, 2), datetime.datetime(2024, 9, 2, 8, 30), datetime.date(2024, 9, 2),
+             '2024-09-02', '2024/9/2', '张伟2024-9-2', '第一周', '第十二周', '第三周张伟', '张伟第一周',
+             '2张伟', '12', '1.5', '3.5张伟', '.5', '张伟.5', '张伟1.', '张伟1.2.3', '张伟0', '张伟 2',
+             '王', '王1', '王高', '王高一', '高一', '高一3', '张伟高一', '张伟高一3', '张伟高一3班', '张伟高四',
+             '张伟高一高二', 'Amy高二5', 'Amy初一', '张伟小二早读', '高', '晚', '晚自', '早自2']
+    for t in TEACHERS:
+        cells += [t, t + '2', t + '0.5', t + ' 1.5 ']
+        for kt in KNOWN_TYPES: cells += [t + kt, t + kt + '2', t + kt + '1.5', kt + t]
+        for g in GRADES: cells += [t + g, t + g + '5', t + g + '5班', t + g + '甲2', t + g + 'x', t + g + kt + '3']
+    # 去掉数字/类别后只剩一个字
+    cells += [kt[0] + kt for kt in KNOWN_TYPES] + ['甲' + g + '1' for g in GRADES] + ['甲1', 'x2', 'a']
+    return cells
+
+def expected(cells, index):
+    rows = {i: r for i, r in zip(index, (parse_class_string(c) for c in cells)) if r is not None}
+    return pd.DataFrame.from_dict(rows, orient='index', columns=LESSON_COLS)
+
+def test_series_matches_scalar():
+    cells = corpus()
+    index = pd.RangeIndex(100, 100 + len(cells))
+    got = parse_class_series(pd.Series(cells, index=index, dtype=object))
+    want = expected(cells, index)
+    assert len(want) > 100
+    pd.testing.assert_frame_equal(got.reset_index(drop=False), want.reset_index(drop=False), check_dtype=False)
+    assert got['课时数'].map(type).eq(float).all()
+
+def test_block_matches_scalar():
+    cells = corpus()
+    half = len(cells) // 2
+    block = pd.DataFrame({'甲': pd.Series(cells[:half], dtype=object), '乙': pd.Series(cells[half:2 * half], dtype=object)})
+    got = parse_class_series(block)
+    stacked = block.unstack()
+    want = expected(list(stacked), stacked.index)
+    pd.testing.assert_frame_equal(got, want, check_dtype=False)
+
+def test_empty_and_all_ignored():
+    assert parse_class_series(pd.Series([], dtype=object)).empty
+    got = parse_class_series(pd.Series([None, '体育', '2024-09-02'], dtype=object))
+    assert got.empty and list(got.columns) == LESSON_COLS